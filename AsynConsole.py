@@ -134,14 +134,10 @@ class AsynConsole(InteractiveInterpreter):
         return more
 
 if __name__ == '__main__':
-    import time
-
     localTest = 5
 
     evScheduler = EventScheduler()
     myConsole = AsynConsole(evScheduler, locals()).interact()
 
     print "Now in event loop..."
-    while True:
-        evScheduler.poll()
-        time.sleep(0.01)
+    evScheduler.run()
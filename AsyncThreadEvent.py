@@ -102,7 +102,5 @@ if __name__ == '__main__':
   evScheduler.scheduleEvent(test_schedThread, [ate], 2)
 
   print "In Event Loop..."
-  while True:
-    evScheduler.poll()
-    time.sleep(0.01)
+  evScheduler.run()
   
@@ -47,6 +47,7 @@ import re
 import time
 import logging
 import Deferred
+import reactor
 import sys
 
 log = logging.getLogger("apy.%s" % (__name__))
@@ -65,14 +66,30 @@ class AsyncXMLRPCRequestHandler(asyncore.dispatcher):
   # Regular expression to match HTTP POST header
   HDREXPR = re.compile(r'^(\w+).*^Content-Length\D+(\d+).*<\?xml', re.MULTILINE | re.IGNORECASE | re.DOTALL)
 
-  def __init__(self, cloneSocket, rpcDispatch):
+  def __init__(self, cloneSocket, rpcDispatch, scheduler=None, requestTimeout=None):
     self.cloneSocket = cloneSocket    
     self.rpcDispatch = rpcDispatch
     self.rxBuf = ""
     self.txBuf = ""
     self.contentLen = 0
     self.state = self.GETHDR
+    self.timer = None
     asyncore.dispatcher.__init__(self, cloneSocket)
+    # Drop clients that don't deliver a complete request in time
+    if scheduler is not None and requestTimeout:
+      self.timer = scheduler.schedule(requestTimeout, self._requestTimedOut)
+
+  def _requestTimedOut(self):
+    self.timer = None
+    log.debug("Closing connection, no complete request received in time")
+    self.close()
+    return False
+
+  def close(self):
+    if self.timer is not None:
+      self.timer.Stop()
+      self.timer = None
+    asyncore.dispatcher.close(self)
 
   def dispatchXmlRequest(self, data):
     """Invoke the requested method, and either transmit response immediately or register callback to 
@@ -133,12 +150,16 @@ class AsyncXMLRPCRequestHandler(asyncore.dispatcher):
           if len(self.rxBuf) >= self.contentLen:
             data = self.rxBuf[:self.contentLen]
             self.rxBuf = self.rxBuf[self.contentLen:]
+            if self.timer is not None:
+              # The request is complete, a slow (Deferred) response is not a reason to give up
+              self.timer.Stop()
+              self.timer = None
             self.dispatchXmlRequest(data)
             self.state = self.GETHDR
             if __debug__:
               log.debug("got all data")
           else:
-            # TODO:  Timeout so we don't wait here forever to receive falsely advertised contentLength
+            # A falsely advertised contentLength would keep us here forever, see requestTimeout
             break
 
   def handle_write(self):
@@ -194,21 +215,26 @@ class AsyncXMLRPCDispatcher(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
 
 
 class AsyncXMLRPCServer(asyncore.dispatcher, AsyncXMLRPCDispatcher):
-  """Start an XMLRPC listener at given address (ip/port tuple)"""
-  def __init__(self, addr):
+  """Start an XMLRPC listener at given address (ip/port tuple).
+     With an EventScheduler, connections that haven't delivered a complete request within
+     requestTimeout seconds are closed.
+  """
+  def __init__(self, addr, scheduler=None, requestTimeout=30.0):
     asyncore.dispatcher.__init__(self)
     AsyncXMLRPCDispatcher.__init__(self)
+    self.scheduler = scheduler
+    self.requestTimeout = requestTimeout
     self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
     self.bind(addr)
     self.listen(5)
 
   def async_loop(self, timeout = 1.0):
-    asyncore.loop(timeout)
+    reactor.loop(timeout)
 
   def handle_accept(self):
     clonesocket, address = self.accept()
     log.debug("RPC connection from %s", address)
-    AsyncXMLRPCRequestHandler(clonesocket, self)
+    AsyncXMLRPCRequestHandler(clonesocket, self, self.scheduler, self.requestTimeout)
 
 
 class XMLRPCRequestHandler(SimpleAsyncHTTPServer.RequestHandler):
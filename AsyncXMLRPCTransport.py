@@ -68,6 +68,11 @@ class Keep_Alive_Session(asyncore.dispatcher):
     if callable(self.close_callable):
       self.close_callable(self)
 
+  def _cancelled(self, deferred):
+    """Canceller of the pending request, the response can't be matched to a request anymore"""
+    self.waiting_on_response = False
+    self.close()
+
   def dispatchXmlResponse(self, response):
       p, u = self.getparser()
       try:
@@ -162,7 +167,7 @@ class Keep_Alive_Session(asyncore.dispatcher):
         "%s%s" % (self.host, len(request_body), keep_alive, request_body)
     #If we have data to send than we will be waiting on a response
     self.waiting_on_response = True
-    self.deferred = Deferred.Deferred()
+    self.deferred = Deferred.Deferred(self._cancelled)
     return self.deferred
 
   def writable(self):
@@ -289,8 +294,8 @@ class AsyncXMLRPCTransport(xmlrpclib.Transport):
             "Content-length: %d\r\n\r\n" % (len(request_body))
       self.txBuf = hdr + request_body
 
-      # Setup async response handler
-      self.deferred = Deferred.Deferred()
+      # Setup async response handler, cancelling it closes the session
+      self.deferred = Deferred.Deferred(self._cancelled)
 
       # Connect to host and POST request
 
@@ -356,6 +361,9 @@ class AsyncXMLRPCTransport(xmlrpclib.Transport):
         log.error(msg) #Using error instead of exception since there is not a stack trace
         self.close()
 
+    def _cancelled(self, deferred):
+      self.close()
+
     def dispatchXmlResponse(self, response):
       p, u = self.parser
       try:
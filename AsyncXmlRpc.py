@@ -276,16 +276,16 @@ def _test(scheduler):
 if __name__ == '__main__':
     global looping
 
-    import asyncore
     import EventScheduler
+    import reactor
 
     scheduler = EventScheduler.EventScheduler()
+    loop = reactor.Reactor(scheduler)
     _test(scheduler)
     looping = True
 
     while looping:
-        asyncore.poll(0.001)
-        scheduler.poll()
+        loop.iterate()
 
     #Some timing code: (last we got 0.003417978594)
     #import timeit
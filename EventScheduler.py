@@ -23,123 +23,752 @@
 
 
 import time
-import threading
-import bisect
-import operator
+import thread
+import collections
+import gc
+import heapq
+import itertools
+import select
+import socket
+import errno
 #import sys
 
 
+# Cancelled entries are only purged from the heap once there are at least this many of them
+# and they outnumber the live ones
+COMPACT_THRESHOLD = 64
+
+# scheduleEvents batches at least this large run with the cyclic garbage collector paused
+BULK_GC_PAUSE = 1000
+
+# Default for EventScheduler.completionBatch
+COMPLETION_BATCH = 1000
+
+# What schedule_periodic does about ticks that were missed because the loop fell behind
+SKIP = 'skip'           # Drop them and stay on the original grid, counting them as coalesced
+CATCH_UP = 'catch-up'   # Run every one of them, one per poll, until back on schedule
+
+# Priority lanes, events that are due run in lane order
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+
 class EventElement(object):
+  # No per-instance __dict__, this is what every pending timer costs in memory
+  __slots__ = ('func', 'params', 'kwargs', 'delay', 'fireTime', 'scheduler', 'entry', 'cancelled',
+               'priority', 'period', 'policy', 'coalesced', 'key')
+
   def __init__(self, func, delay=0.0, time_func=time.time, *args, **kwargs):
     self.func = func
     self.params = args
     self.kwargs = kwargs
     self.delay = delay
     self.fireTime = time_func() + delay
+    self.scheduler = None  # EventScheduler this element was last queued on
+    self.entry = None      # Heap entry, kept for reuse once popped, see EventScheduler._push
+    self.cancelled = False
+    self.priority = PRIORITY_NORMAL
+    self.period = None     # Set for fixed-rate events, see EventScheduler.schedule_periodic
+    self.policy = SKIP
+    self.coalesced = 0     # Ticks dropped by the SKIP policy
+    self.key = None        # Set for events of EventScheduler.debounce and throttle
 
   def sortKey(self):
     return self.fireTime
 
   def __lt__(self, other):
-    #Used when bisecting the current event queue
-    return operator.lt(self.fireTime, other.fireTime)
+    # The scheduler itself only compares heap entries, this is for sorting lists of elements
+    return self.fireTime < other.fireTime
 
   def Stop(self, *args, **kwargs):
     #if self.func != self.Stop:
       #print "Stopped %s" % self.func.im_func.func_name
     self.func = self.Stop
+    if self.scheduler is not None:
+      self.scheduler.unschedule(self)
+
+
+class Waker(object):
+  """Socket pair used to interrupt a select() call from another thread.
+     Sockets are used instead of os.pipe() so the read end can be selected on Windows too.
+  """
+  def __init__(self):
+    if hasattr(socket, 'socketpair'):
+      self.reader, self.writer = socket.socketpair()
+    else:
+      listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      listener.bind(('127.0.0.1', 0))
+      listener.listen(1)
+      self.writer = socket.create_connection(listener.getsockname())
+      self.reader, addr = listener.accept()
+      listener.close()
+    self.reader.setblocking(0)
+    self.writer.setblocking(0)
+
+  def fileno(self):
+    return self.reader.fileno()
+
+  def wake(self):
+    try:
+      self.writer.send('x')
+    except socket.error, e:
+      if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise
+      # The buffer is full of wake-ups already
+
+  def drain(self):
+    try:
+      while self.reader.recv(4096):
+        pass
+    except socket.error, e:
+      if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise
+
+  def close(self):
+    self.reader.close()
+    self.writer.close()
 
 
 #---------------------------------------------------------------------------------------------------
 class EventScheduler(object):
-  """Event queue mechanism, asynchronously polled, dispatching bound methods with optional delay."""
-  def __init__(self, time_func=time.time):
+  """Event queue mechanism, asynchronously polled, dispatching bound methods with optional delay.
+
+     Pending events are kept in a binary heap of [fireTime, sequence, EventElement] entries, so
+     scheduling costs O(log n) and a poll only touches the events that are actually due.
+     The sequence number keeps events with equal fire times in the order they were scheduled.
+
+     Unscheduling is O(1): the heap entry is turned into a tombstone (its event slot set to None)
+     and dropped when it reaches the top of the heap, or when the heap is compacted because
+     tombstones outnumber live events.  liveCount and cancelledCount track both populations.
+
+     Only the loop thread (the one calling poll) touches the heap, so it needs no lock.  Other
+     threads hand their events and cancellations over through deques, relying on append and
+     popleft being atomic under the GIL, and the loop drains them at the start of each poll.
+
+     With monotonic=True the scheduler ignores time_func and uses the cheapest monotonic clock
+     available, so wall-clock steps neither fire every timer at once nor stall them.  In this mode
+     the clock is read once per poll: events rescheduled by that poll are all relative to the
+     same 'now', which is also left in self.now for the callbacks to use.
+     EventElements passed to scheduleEvents must be created with time_func=scheduler.time.
+
+     Events that are due are served by priority lane (PRIORITY_HIGH, _NORMAL, _LOW) rather than
+     purely by fire time.  By default a lower lane only runs once the ones above it are empty;
+     'weights' gives the number of events each lane may run per round instead, e.g. (8, 4, 1),
+     so a flood of high priority events can't starve the others completely.
+
+     Objects in 'monitors' are told about every event poll runs, see instrumentation.py.  With
+     the list empty the only cost is one truth test per event.
+
+     debounce() and throttle() keep at most one pending event per key, for work that gets
+     requested far more often than it needs to run.
+
+     postCompletion() is the cheap way for worker threads to hand results to the loop: no
+     EventElement and no heap, the completions are run in one batch at the start of each poll,
+     at most completionBatch of them per poll.
+  """
+  def __init__(self, time_func=time.time, monotonic=False, weights=None):
+    if monotonic:
+      import monotime
+      time_func = monotime.monotonic_time
     self.eventQueue = []
-    self.lock = threading.RLock()
     self.time = time_func
+    self.monotonic = monotonic
+    self.now = None # Time of the current or last poll
     self.running = False
+    self._sequence = itertools.count()
+    self.liveCount = 0
+    self.cancelledCount = 0
+    self.coalescedCount = 0 # Periodic ticks dropped by the SKIP policy, over all events
+    # Thread of the last poll or prepareWait.  Until one runs, every thread hands its events over
+    # through the deques, so the heap never has two owners.
+    self._loopThread = None
+    self._incoming = collections.deque()  # Events scheduled from other threads
+    self._cancels = collections.deque()   # Events unscheduled from other threads
+    self._completions = collections.deque() # (func, args) from postCompletion
+    self.completionBatch = COMPLETION_BATCH
+    # Due events by priority, only holds events between polls when a poll runs out of budget
+    self._lanes = [collections.deque() for priority in PRIORITIES]
+    self.weights = weights
+    if weights is not None:
+      if len(weights) != len(PRIORITIES) or min(weights) <= 0:
+        raise ValueError("weights needs a positive share for each of the %d priorities" % len(PRIORITIES))
+      self._credits = list(weights)
+    self.pollStats = {'events': 0, 'time': 0.0, 'backlog': 0}
+    self._keyed = {} # key -> pending event of debounce/throttle, loop thread only
+    # Each gets eventStarted(event, started) and eventFinished(event, started, finished, rescheduled),
+    # by the time of eventFinished a rescheduled event already has its next fireTime
+    self.monitors = []
+    self.waker = None
+    self.looping = False
+    self._waiting = False # True while run() sleeps until _wakeAt
+    self._wakeAt = None
+
+  def _push(self, event):
+    """Add an EventElement to the heap, loop thread only"""
+    entry = event.entry
+    if entry is None or entry[2] is not None:
+      event.entry = entry = [event.fireTime, next(self._sequence), event]
+    else:
+      # Popped earlier, so the element can reuse its old entry
+      entry[0] = event.fireTime
+      entry[1] = next(self._sequence)
+      entry[2] = event
+    event.scheduler = self
+    event.cancelled = False
+    self.liveCount += 1
+    heapq.heappush(self.eventQueue, entry)
+
+  def _remove(self, event):
+    """Take a queued EventElement out of the heap, loop thread only.  False if it wasn't queued."""
+    entry = event.entry
+    if entry is not None and entry[2] is event:
+      # Leave a tombstone behind instead of searching the heap for it, the entry stays in the heap
+      entry[2] = None
+      event.entry = None
+      self.liveCount -= 1
+      self.cancelledCount += 1
+      if self.cancelledCount > COMPACT_THRESHOLD and self.cancelledCount > self.liveCount:
+        self._compact()
+      return True
+    return False
+
+  def _submit(self, event):
+    """Hand an event scheduled on another thread over to the loop thread"""
+    event.scheduler = self
+    self._incoming.append(event)
+    if self._waiting:
+      wakeAt = self._wakeAt
+      if wakeAt is None or event.fireTime < wakeAt:
+        self._waiting = False
+        self.waker.wake()
+
+  def _drainIncoming(self):
+    """Push the events handed over by other threads, loop thread only"""
+    incoming = self._incoming
+    if incoming:
+      events = []
+      while incoming:
+        event = incoming.popleft()
+        if not event.cancelled:
+          events.append(event)
+      self._pushMany(events)
+    cancels = self._cancels
+    while cancels:
+      event = cancels.popleft()
+      event.cancelled = True
+      self._remove(event)
+
+  def _popDue(self, now):
+    """Remove and return the events due at 'now' in firing order, loop thread only"""
+    workq = []
+    queue = self.eventQueue
+    while queue and queue[0][0] <= now:
+      entry = heapq.heappop(queue)
+      e = entry[2]
+      if e is None:
+        self.cancelledCount -= 1
+      else:
+        entry[2] = None # Out of the heap, _push may reuse it
+        self.liveCount -= 1
+        workq.append(e)
+    return workq
+
+  def _nextReady(self):
+    """Take the next due event to run from the priority lanes, None once they are empty"""
+    lanes = self._lanes
+    if self.weights is None:
+      for lane in lanes:
+        if lane:
+          return lane.popleft()
+      return None
+
+    credits = self._credits
+    for attempt in (0, 1):
+      for priority, lane in enumerate(lanes):
+        if lane and credits[priority] > 0:
+          credits[priority] -= 1
+          return lane.popleft()
+      # Every lane with events left has used up its share, start a new round
+      credits[:] = self.weights
+    return None
+
+  def backlog(self):
+    """Return the number of due events and completions waiting for the next poll"""
+    return sum([len(lane) for lane in self._lanes]) + len(self._completions)
+
+  def postCompletion(self, func, *args):
+    """Have the loop thread call func(*args) at the start of its next poll, from any thread.
+       Completions run in the order they were posted, and ahead of all timers, except that a
+       bounded poll() keeps half of its budget for the due timers.  Their return value is
+       ignored, there is no rescheduling or unscheduling.  They count towards the budget of
+       poll(), and monitors see them as events with no lateness.
+    """
+    self._completions.append((func, args))
+    if self._waiting:
+      self._waiting = False
+      self.waker.wake()
+
+  def _runCompletions(self, max_events, sliceEnd):
+    """Run a batch of posted completions within the poll budget, loop thread only.
+       Returns how many ran, at least one.
+    """
+    completions = self._completions
+    count = min(len(completions), self.completionBatch)
+    if max_events is not None and max_events < count:
+      count = max(max_events, 1)
+    popleft = completions.popleft
+    monitors = self.monitors
+    if not monitors and sliceEnd is None:
+      for i in xrange(count):
+        func, args = popleft()
+        func(*args)
+      return count
+
+    for i in xrange(count):
+      if sliceEnd is not None and i and self.time() >= sliceEnd:
+        return i
+      func, args = popleft()
+      if not monitors:
+        func(*args)
+        continue
+      # Monitors expect an EventElement, only built for them; it is due right away
+      e = EventElement(func, 0.0, self.time, *args)
+      started = e.fireTime
+      for monitor in monitors:
+        monitor.eventStarted(e, started)
+      try:
+        func(*args)
+      except:
+        finished = self.time()
+        for monitor in monitors:
+          monitor.eventFinished(e, started, finished, False)
+        raise
+      finished = self.time()
+      for monitor in monitors:
+        monitor.eventFinished(e, started, finished, False)
+    return count
+
+  def _compact(self):
+    """Drop all tombstones from the heap, loop thread only"""
+    self.eventQueue[:] = [entry for entry in self.eventQueue if entry[2] is not None]
+    heapq.heapify(self.eventQueue)
+    self.cancelledCount = 0
 
   def schedule(self, delay, callable, *args, **kwargs):
     """Order of parameters is like wx.CallLater and supports keyword arguments unlike scheduleEvent"""
     #print "%s scheduled %s" % (sys._getframe(1).f_code.co_name, callable.im_func.func_name)
     event = EventElement(callable, delay, self.time, *args, **kwargs)
-    self.lock.acquire()
-    self.eventQueue.append(event)
-    self.lock.release()
+    if thread.get_ident() == self._loopThread:
+      self._push(event)
+    else:
+      self._submit(event)
     #event.creator = sys._getframe(1).f_code.co_name
     return event
 
-  def scheduleEvent(self, func, params=[], delay=0.0):
+  def schedulePriority(self, priority, delay, callable, *args, **kwargs):
+    """Like schedule, with the priority lane given first"""
+    event = EventElement(callable, delay, self.time, *args, **kwargs)
+    event.priority = priority
+    if thread.get_ident() == self._loopThread:
+      self._push(event)
+    else:
+      self._submit(event)
+    return event
+
+  def scheduleEvent(self, func, params=[], delay=0.0, priority=PRIORITY_NORMAL):
     """Schedule event:
          func is a bound method or callable object, return True to reschedule,
          return float value to set new delay AND reschedule;
          params is a list of parameters to func;
-         delay is in seconds
+         delay is in seconds;
+         priority is the lane the event runs in once due
     """
     #print "%s scheduled event %s" % (sys._getframe(0).f_code.co_name, func.im_func.func_name)
-    self.lock.acquire()
-    self.eventQueue.append(EventElement(func, delay, self.time, *params))
-    self.lock.release()
+    event = EventElement(func, delay, self.time, *params)
+    event.priority = priority
+    if thread.get_ident() == self._loopThread:
+      self._push(event)
+    else:
+      self._submit(event)
 
   def scheduleEvents(self, eventList):
-    """Schedule a list of EventElements:
-         This is an alternative to discrete scheduleEvent() calls, but accomplishes the same thing.
-         It takes the thread-lock fewer times, but may not actually be faster than discrete calls
-         to scheduleEvent() if the average size of the eventQueue is large.
+    """Schedule a batch of events in one go and return them as EventElements:
+         Items are EventElements or (delay, func[, params]) tuples, in any order.  A batch that is
+         large compared to the queue is merged by rebuilding the heap, O(n + k), instead of k
+         separate O(log n) pushes.
+         None of the objects a batch creates are garbage, so big batches pause the garbage
+         collector rather than have it walk the growing heap over and over.
+    """
+    pauseGc = len(eventList) >= BULK_GC_PAUSE and gc.isenabled()
+    if pauseGc:
+      gc.disable()
+    try:
+      events = self._bulkEvents(eventList)
+      if thread.get_ident() == self._loopThread:
+        self._pushMany(events)
+      else:
+        for event in events:
+          self._submit(event)
+    finally:
+      if pauseGc:
+        gc.enable()
+    return events
+
+  def _bulkEvents(self, eventList):
+    """Return eventList with the tuples turned into EventElements"""
+    events = []
+    append = events.append
+    time_func = self.time
+    for event in eventList:
+      if not isinstance(event, EventElement):
+        if len(event) > 2:
+          event = EventElement(event[1], event[0], time_func, *event[2])
+        else:
+          event = EventElement(event[1], event[0], time_func)
+      append(event)
+    return events
+
+  def _pushMany(self, events):
+    """Add a list of EventElements to the heap, loop thread only"""
+    queue = self.eventQueue
+    total = len(queue) + len(events)
+    if len(events) * total.bit_length() < total:
+      for event in events:
+        self._push(event)
+      return
+
+    sequence = self._sequence
+    append = queue.append
+    for event in events:
+      event.scheduler = self
+      event.cancelled = False
+      event.entry = entry = [event.fireTime, next(sequence), event]
+      append(entry)
+    self.liveCount += len(events)
+    heapq.heapify(queue)
+
+  def debounce(self, key, delay, callable, *args, **kwargs):
+    """Run callable 'delay' seconds after the last debounce() call for key:
+         while an event for key is pending each call pushes it back and replaces its callable and
+         arguments, so a burst of calls runs it once, with the latest arguments.
+    """
+    self._scheduleKeyed(True, key, delay, callable, args, kwargs)
+
+  def throttle(self, key, delay, callable, *args, **kwargs):
+    """Run callable 'delay' seconds after the first throttle() call for key:
+         while that event is pending further calls only replace its callable and arguments, so it
+         runs at most once per 'delay' however often it is requested.
     """
-    self.lock.acquire()
-    self.eventQueue.extend(eventList)
-    self.lock.release()
+    self._scheduleKeyed(False, key, delay, callable, args, kwargs)
 
-  def poll(self):
-    """Run the event scheduler, return the number of events called"""
+  def cancelKey(self, key):
+    """Unschedule the pending debounce/throttle event for key, if any.
+       From another thread it takes effect after that thread's earlier requests for key.
+    """
+    if thread.get_ident() == self._loopThread:
+      self._cancelKey(key)
+    else:
+      # Handed over like _scheduleKeyed, so it is applied in order with the requests before it
+      event = EventElement(self._cancelKey, 0.0, self.time, key)
+      event.priority = PRIORITY_HIGH
+      self._submit(event)
+
+  def _cancelKey(self, key):
+    """Unschedule the pending event for key, loop thread only"""
+    event = self._keyed.get(key)
+    if event is not None:
+      self.unschedule(event)
+
+  def _scheduleKeyed(self, restart, key, delay, func, args, kwargs):
+    fireTime = self.time() + delay
+    if thread.get_ident() == self._loopThread:
+      self._applyKeyed(restart, key, delay, fireTime, func, args, kwargs)
+    else:
+      # The key table belongs to the loop thread, apply the request there ahead of other events
+      event = EventElement(self._applyKeyed, 0.0, self.time, restart, key, delay, fireTime, func, args, kwargs)
+      event.priority = PRIORITY_HIGH
+      self._submit(event)
+
+  def _applyKeyed(self, restart, key, delay, fireTime, func, args, kwargs):
+    """Create or update the pending event for key, loop thread only"""
+    event = self._keyed.get(key)
+    if event is None or event.cancelled:
+      event = EventElement(func, delay, self.time, *args, **kwargs)
+      event.fireTime = fireTime
+      event.key = key
+      self._keyed[key] = event
+      self._push(event)
+      return
+
+    event.func = func
+    event.params = args
+    event.kwargs = kwargs
+    # An event that is already due and waiting in a lane just runs with the new arguments
+    if restart and self._remove(event):
+      event.delay = delay
+      event.fireTime = fireTime
+      self._push(event)
+
+  def poll(self, max_events=None, max_time=None):
+    """Run the event scheduler, return the number of events called.
+       max_events and max_time (in seconds) bound the work done by one call, completions
+       included, so a burst of due events can't starve socket I/O.  While events are due,
+       completions run in the first half of the budget and whatever the due events leave of
+       theirs, so they can't starve timers either.  Due events over budget stay queued, in
+       order, and run first on the next poll, still ahead of lower priority lanes.  At least one
+       event runs per poll when any is due.
+       pollStats holds the events run, time spent and due events left over ('backlog').
+    """
     if self.running:
       #print "bailing! poll called while in the middle of another poll"
       return 0
 
-    self.lock.acquire()
-    self.eventQueue.sort(key=EventElement.sortKey)
-    i = bisect.bisect_right(self.eventQueue, EventElement(None, 0, self.time))
-    workq = self.eventQueue[:i]
-    self.eventQueue = self.eventQueue[i:]
-    self.lock.release()
-
+    self._loopThread = thread.get_ident()
+    self._drainIncoming()
+    # Pop only the due events, anything scheduled while they run waits for the next poll
+    now = self.now = self.time()
+    lanes = self._lanes
+    for e in self._popDue(now):
+      lanes[e.priority].append(e)
+    cachedNow = self.monotonic
+    sliceEnd = None
+    if max_time is not None:
+      sliceEnd = self.time() + max_time
+
+    called = 0
+    heldBack = 0 # Completions kept out of the budget of the due events
+    monitors = self.monitors
     self.running = True
-    for e in workq:
-      rv = e.func(*e.params, **e.kwargs)
-      if isinstance(rv, bool):
-        reschedule = rv
-      elif isinstance(rv, float) or isinstance(rv, int):
-        e.delay = rv
-        reschedule = True
+    if self._completions:
+      budget = max_events
+      completionsEnd = sliceEnd
+      if any(lanes) and (max_events is not None or max_time is not None):
+        # Leave half of the budget to the due events, or a steady stream of completions
+        # would keep them waiting forever.  They get back whatever the due events leave.
+        heldBack = self.completionBatch
+        if max_events is not None:
+          budget = max_events // 2
+        if max_time is not None:
+          completionsEnd = sliceEnd - max_time / 2.0
+      if budget != 0:
+        called = self._runCompletions(budget, completionsEnd)
+        heldBack -= called
+    while True:
+      if max_events is not None and called >= max_events:
+        break
+      if max_time is not None and called and self.time() >= sliceEnd:
+        break
+      e = self._nextReady()
+      if e is None:
+        break
+      if e.key is not None and self._keyed.get(e.key) is e:
+        # Further requests for the key get a new event from now on
+        del self._keyed[e.key]
+      if e.cancelled:
+        # Unscheduled by one of the events that ran before it in this poll
+        continue
+      called += 1
+      if monitors:
+        started = self.time()
+        for monitor in monitors:
+          monitor.eventStarted(e, started)
+        try:
+          rv = e.func(*e.params, **e.kwargs)
+        except:
+          finished = self.time()
+          for monitor in monitors:
+            monitor.eventFinished(e, started, finished, False)
+          raise
+        finished = self.time()
       else:
-        reschedule = False
-      if reschedule:
-        e.fireTime = self.time() + e.delay
-        #e.fireTime += e.delay     # If we wanted accurate periodicity, versus accurate intervals
-        self.lock.acquire()
-        self.eventQueue.append(e)
-        self.lock.release()
+        rv = e.func(*e.params, **e.kwargs)
+
+      if e.period is not None:
+        reschedule = self._reschedulePeriodic(e, rv)
+      else:
+        if isinstance(rv, bool):
+          reschedule = rv
+        elif isinstance(rv, float) or isinstance(rv, int):
+          e.delay = rv
+          reschedule = True
+        else:
+          reschedule = False
+        if reschedule and not e.cancelled:
+          if cachedNow:
+            e.fireTime = now + e.delay
+          else:
+            e.fireTime = self.time() + e.delay
+          #e.fireTime += e.delay     # If we wanted accurate periodicity, versus accurate intervals
+          self._push(e)
+        else:
+          reschedule = False
+      if monitors:
+        for monitor in monitors:
+          monitor.eventFinished(e, started, finished, reschedule)
+    if heldBack > 0 and self._completions:
+      if max_events is not None:
+        heldBack = min(heldBack, max_events - called)
+      if heldBack > 0 and (max_time is None or self.time() < sliceEnd):
+        called += self._runCompletions(heldBack, sliceEnd)
     self.running = False
 
-    return i
+    stats = self.pollStats
+    stats['events'] = called
+    stats['time'] = self.time() - now
+    stats['backlog'] = self.backlog()
+    return called
+
+  def _reschedulePeriodic(self, e, rv):
+    """Advance a fixed-rate event by whole periods from its previous fire time, False if it stops"""
+    if rv is False or e.cancelled:
+      return False
+    if not isinstance(rv, bool) and isinstance(rv, (int, float)):
+      if rv <= 0:
+        # A zero period would never advance the fire time, stop like False instead
+        return False
+      e.period = e.delay = rv
+
+    if self.monotonic:
+      now = self.now
+    else:
+      now = self.time()
+    nextFire = e.fireTime + e.period
+    if nextFire <= now and e.policy == SKIP:
+      missed = int((now - e.fireTime) / e.period)
+      e.coalesced += missed
+      self.coalescedCount += missed
+      nextFire = e.fireTime + (missed + 1) * e.period
+    e.fireTime = nextFire
+    self._push(e)
+    return True
+
+  def schedule_periodic(self, interval, func, params=[], policy=SKIP, delay=None):
+    """Schedule func to run every 'interval' seconds at a fixed rate:
+         Fire times are computed from the previous fire time rather than from when the callback
+         finished, so the period doesn't drift.  func keeps being called until it returns False,
+         it is unscheduled or Stop()ed; returning a number changes the interval, and a number
+         of zero or less stops it like False.
+         policy is SKIP or CATCH_UP and decides what happens to ticks missed while the loop was
+         busy; skipped ticks are counted in the returned event's 'coalesced' attribute.
+         delay is the time until the first call, one interval by default.
+    """
+    if interval <= 0:
+      raise ValueError("interval must be positive")
+    if policy not in (SKIP, CATCH_UP):
+      raise ValueError("unknown policy %r" % (policy,))
+    if delay is None:
+      delay = interval
+    event = EventElement(func, delay, self.time, *params)
+    event.period = interval
+    event.policy = policy
+    self.scheduleEvents([event])
+    return event
+
+  def next_deadline(self):
+    """Return the time at which the next event is due, or None if nothing is scheduled.
+       Only meaningful on the loop thread.
+    """
+    if self._completions or self._incoming:
+      # self.now is still None before the first poll, and handed over events aren't queued yet
+      return self.time()
+    for lane in self._lanes:
+      if lane:
+        return self.now
+    queue = self.eventQueue
+    while queue and queue[0][2] is None:
+      heapq.heappop(queue)
+      self.cancelledCount -= 1
+    if queue:
+      return queue[0][0]
+    return None
+
+  def time_until_next(self):
+    """Return the seconds until the next event is due (0.0 if overdue), or None if nothing is scheduled"""
+    deadline = self.next_deadline()
+    if deadline is None:
+      return None
+    return max(0.0, deadline - self.time())
+
+  def getWaker(self):
+    """Return the Waker written to when an earlier event is scheduled while run() is sleeping"""
+    if self.waker is None:
+      self.waker = Waker()
+    return self.waker
+
+  def prepareWait(self, timeout=None):
+    """Arm the Waker and return how long the caller may block, None meaning forever.
+       For loops that select() on the Waker along with their own file descriptors;
+       call finishWait() once woken up.
+    """
+    self._loopThread = thread.get_ident()
+    self.getWaker()
+    # Arm before draining: an event submitted after the drain then always sees _waiting set,
+    # and _wakeAt of None makes it wake us until the real deadline is known
+    self._wakeAt = None
+    self._waiting = True
+    self._drainIncoming()
+    deadline = self.next_deadline()
+    self._wakeAt = deadline
+
+    if deadline is not None:
+      deadline = max(0.0, deadline - self.time())
+      if timeout is None or deadline < timeout:
+        timeout = deadline
+    return timeout
+
+  def finishWait(self):
+    """Disarm the Waker after prepareWait()"""
+    self._waiting = False
+
+  def wait(self, timeout=None):
+    """Sleep until the next event is due, an earlier one gets scheduled, or timeout expires"""
+    timeout = self.prepareWait(timeout)
+    if timeout is None or timeout > 0:
+      readable = select.select([self.waker], [], [], timeout)[0]
+      if readable:
+        self.waker.drain()
+    self.finishWait()
+
+  def run(self):
+    """Dispatch events until stop() is called, sleeping in between instead of busy-polling"""
+    self.getWaker()
+    self.looping = True
+    while self.looping:
+      self.poll()
+      if self.looping:
+        self.wait()
+
+  def stop(self):
+    """Make run() return once the current poll completes, can be called from any thread"""
+    self.looping = False
+    # Always wake, run() may be just about to go to sleep
+    if self.waker is not None:
+      self.waker.wake()
 
   def printQueue(self):
     """Debugging helper"""
-    for mye in self.eventQueue:
+    for fireTime, sequence, mye in sorted(self.eventQueue):
+      if mye is None:
+        continue
       try:
         print mye.params[0], mye.fireTime, mye.delay
       except IndexError:
         print "no params", mye.fireTime, mye.delay
 
   def unschedule(self, event):
-    """Removes the scheduled event from the queue"""
-    self.lock.acquire()
-    try:
-      self.eventQueue.remove(event)
-    except ValueError:
-      pass # No need to error if it is not in the queue
-    self.lock.release()
+    """Removes the scheduled event from the queue.
+       Also stops an event from being rescheduled if it is currently running.
+    """
+    if event.scheduler is not self:
+      return # No need to error if it is not in the queue
+
+    event.cancelled = True
+    if thread.get_ident() == self._loopThread:
+      self._remove(event)
+    else:
+      self._cancels.append(event)
 
 
 #---------------------------------------------------------------------------------------------------
@@ -201,10 +830,136 @@ if __name__=='__main__':
   t = timeit.Timer("sked.scheduleEvents(evs)", "from __main__ import sked, evs")
   print t.timeit(1)
 
-
-  while True:
-    sked.poll()
-    time.sleep(0.1)
+  # Bulk insert of 100000 timers into a queue already holding 100000, against discrete schedule() calls
+  import random
+  batch = [(random.uniform(60.0, 120.0), immediateFunc) for i in xrange(100000)]
+  for label, order in (("unsorted", batch), ("sorted", sorted(batch))):
+    discreteSked = EventScheduler()
+    bulkSked = EventScheduler()
+    for bench in (discreteSked, bulkSked):
+      bench.poll() # Makes this the loop thread, so the timers go straight onto the heap
+      for i in xrange(100000):
+        bench.schedule(3600.0 + i, immediateFunc)
+    start = time.time()
+    for delay, func in order:
+      discreteSked.schedule(delay, func)
+    discrete = time.time() - start
+    start = time.time()
+    bulkSked.scheduleEvents(order)
+    bulk = time.time() - start
+    print "100000 %s timers: schedule() %.3f sec, scheduleEvents() %.3f sec" % (label, discrete, bulk)
+
+  # Polling cost with lots of pending (not yet due) events should stay small
+  idleSked = EventScheduler()
+  idleSked.poll()
+  for i in range(50000):
+    idleSked.schedule(3600.0 + i, immediateFunc)
+  t = timeit.Timer("idleSked.poll()", "from __main__ import idleSked")
+  print "idle poll with %d pending: %.1f usec" % (len(idleSked.eventQueue), t.timeit(1000) * 1000)
+
+  # Contention: 8 producer threads hand events to the loop thread while it keeps polling
+  import threading
+  producerSked = EventScheduler()
+  perProducer = 50000
+  delivered = [0]
+  def consume():
+    delivered[0] += 1
+  def produce():
+    for i in xrange(perProducer):
+      producerSked.scheduleEvent(consume)
+  producers = [threading.Thread(target=produce) for i in range(8)]
+  start = time.time()
+  for p in producers:
+    p.start()
+  while delivered[0] < 8 * perProducer:
+    producerSked.poll()
+  elapsed = time.time() - start
+  print "8 producers: %d events scheduled and run in %.2f sec (%.0f events/sec)" % (delivered[0], elapsed, delivered[0] / elapsed)
+
+  # Time-sliced polling: a burst of immediate events is spread over polls of at most 5 msec
+  burstSked = EventScheduler()
+  burstSked.poll()
+  for i in xrange(50000):
+    burstSked.scheduleEvent(consume)
+  slices = 0
+  maxBacklog = 0
+  while burstSked.poll(max_time=0.005):
+    slices += 1
+    maxBacklog = max(maxBacklog, burstSked.pollStats['backlog'])
+  print "50000 event burst ran in %d polls of <= 5 msec, largest backlog %d" % (slices, maxBacklog)
+
+  # Latency of probe events under a flood of low priority events that keep re-arming
+  def flood():
+    return True
+  for probePriority in (PRIORITY_LOW, PRIORITY_HIGH):
+    laneSked = EventScheduler()
+    laneSked.poll()
+    for i in xrange(20000):
+      laneSked.scheduleEvent(flood, priority=PRIORITY_LOW)
+    latencies = []
+    def probe(scheduledAt):
+      latencies.append(laneSked.time() - scheduledAt)
+    for i in xrange(200):
+      laneSked.scheduleEvent(probe, [laneSked.time()], priority=probePriority)
+      laneSked.poll(max_time=0.002)
+    latencies.sort()
+    print "probe priority %d under low priority flood: p50 %.1f msec, p99 %.1f msec, max %.1f msec (%d of 200 ran)" % (
+      probePriority, latencies[len(latencies) // 2] * 1000, latencies[len(latencies) * 99 // 100] * 1000,
+      latencies[-1] * 1000, len(latencies))
+
+  # Coalescing: a flood of refresh requests leaves a single pending event
+  refreshes = [0]
+  def refresh():
+    refreshes[0] += 1
+  keyedSked = EventScheduler()
+  keyedSked.poll()
+  start = time.time()
+  for i in xrange(100000):
+    keyedSked.debounce('refresh', 0.01, refresh)
+  elapsed = time.time() - start
+  pending, heapSize = keyedSked.liveCount, len(keyedSked.eventQueue)
+  time.sleep(0.02)
+  keyedSked.poll()
+  print "100000 debounce calls: %.2f usec each, %d pending (heap size %d), %d run" % (
+    elapsed / 100000 * 1e6, pending, heapSize, refreshes[0])
+
+  # Memory and throughput with a million pending timers
+  import sys
+  def rssKb():
+    try:
+      import resource
+      return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux, peak not current
+    except ImportError:
+      return 0
+  timerCount = 1000000
+  bigSked = EventScheduler()
+  bigSked.poll()
+  gc.collect()
+  rssBefore = rssKb()
+  start = time.time()
+  for i in xrange(timerCount):
+    bigSked.scheduleEvent(immediateFunc, delay=3600.0 + i)
+  elapsed = time.time() - start
+  e = bigSked.eventQueue[-1][2]
+  perTimer = sys.getsizeof(e) + sys.getsizeof(e.entry) + sys.getsizeof(e.fireTime) + sys.getsizeof(e.delay)
+  print "%d pending timers: %.0f schedules/sec, %d bytes per timer (getsizeof), %.0f bytes per timer (peak RSS)" % (
+    timerCount, timerCount / elapsed, perTimer, (rssKb() - rssBefore) * 1024.0 / timerCount)
+  # Re-arming timers reuse their element and heap entry
+  def rearm():
+    return True
+  for i in xrange(1000):
+    bigSked.scheduleEvent(rearm)
+  bigSked.poll()
+  start = time.time()
+  rounds = 200
+  for i in xrange(rounds):
+    bigSked.poll()
+  elapsed = time.time() - start
+  print "%d re-arming events with %d pending: %.0f events/sec" % (1000, timerCount, 1000 * rounds / elapsed)
+  del bigSked
+
+
+  sked.run()
 
 
 #---------------------------------------------------------------------------------------------------
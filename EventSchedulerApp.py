@@ -2,7 +2,7 @@
 """Combines EventScheduler, asyncore, and wx.App"""
 
 
-import time, asyncore
+import asyncore
 import wx
 import EventScheduler
 
@@ -35,12 +35,16 @@ class EventSchedulerApp(wx.App):
             self._chkTimer.Start(IN_CHECK_YIELD_TIME, True)
 
     def runFuncs(self, tSlice=SLEEP_TIME):
-        asyncore.poll(tSlice)
+        # Don't sit in select() past the next scheduled event
+        timeout = self.evScheduler.time_until_next()
+        if timeout is None or timeout > tSlice:
+            timeout = tSlice
+        asyncore.poll(timeout)
         self.evScheduler.poll()
 
         # asyncore won't block for timeout if it's not waiting on anything
         if not asyncore.socket_map:
-            time.sleep(tSlice)
+            self.evScheduler.wait(tSlice)
 
     def eventLoop(self):
         self.runFuncs()
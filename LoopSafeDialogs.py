@@ -5,6 +5,11 @@ import wx
 from apy import PostThread
 
 
+# Shared by all dialogs, each open dialog holds one of its threads until it is closed.  Not
+# capped, a dialog waiting for a free thread would not show up until another one is closed.
+_modalPool = PostThread.PostThreadPool(maxWorkers=None, maxQueued=0, idleTimeout=30.0)
+
+
 class LoopSafeModal(object):
     """
     Base class to use when creating loop safe dialogs
@@ -30,7 +35,7 @@ class TestDialog(wx.Dialog, LoopSafeModal):
         closeCallback -- The callback to use when dialog is closed
         """
         self._closeCallback = closeCallback
-        PostThread.PostThread().post(wx.GetApp().evScheduler, wx.Dialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
+        _modalPool.post(wx.GetApp().evScheduler, wx.Dialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
 
 
 class FileDialog(wx.FileDialog):
@@ -41,7 +46,7 @@ class FileDialog(wx.FileDialog):
         closeCallback -- The callback to use when dialog is closed
         """
         self._closeCallback = closeCallback
-        PostThread.PostThread().post(wx.GetApp().evScheduler, wx.FileDialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
+        _modalPool.post(wx.GetApp().evScheduler, wx.FileDialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
 
     def _onShowModalComplete(self, *args, **kwargs):
         """Will callback the function passed on ShowModal with result of original blocking ShowModal"""
@@ -61,7 +66,7 @@ class MessageDialog(wx.MessageDialog, LoopSafeModal):
         closeCallback -- The callback to use when dialog is closed
         """
         self._closeCallback = closeCallback
-        PostThread.PostThread().post(wx.GetApp().evScheduler, wx.MessageDialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
+        _modalPool.post(wx.GetApp().evScheduler, wx.MessageDialog.ShowModal, [self]).addCallbacks(self._onShowModalComplete)
 
 
 class TextEntryDialog(wx.TextEntryDialog):
@@ -34,26 +34,59 @@ cb = our callback function
 
 PostThread().post(evQ, waitForIt, [p1,p2]).addCallbacks(cb)
 
+PostThreadPool has the same post() contract, but shares a bounded set of worker threads between
+any number of blocking calls, so they neither serialize behind each other nor leak threads:
+
+pool = PostThreadPool(maxWorkers=4)
+pool.post(evQ, waitForIt, [p1,p2]).addCallbacks(cb)
+
+CPU-bound work doesn't benefit from threads since it holds the GIL, and stalls the event loop
+just the same.  PostProcessPool runs it in worker processes instead; func and params are pickled,
+so func must be a module level function:
+
+PostProcessPool().post(evQ, xmlrpclib.dumps, [hugeParams]).addCallbacks(cb)
+
 """
 
 import Deferred
 import EventScheduler
 import threading
 import Queue
-import time
+import cPickle
+import multiprocessing
 import sys
+import time
+import traceback
 import logging
 
 class PostThreadTerminated(Exception):
   """PostThread has been terminated."""
   pass
 
+class RemoteError(Exception):
+  """Exception raised by a callable run in a PostProcessPool worker process.
+     The original exception can't always be pickled, so its type name, message and
+     formatted traceback are carried over as text.
+  """
+  def __init__(self, excType, message, remoteTraceback):
+    Exception.__init__(self, excType, message, remoteTraceback)
+    self.excType = excType
+    self.message = message
+    self.remoteTraceback = remoteTraceback
+
+  def __str__(self):
+    return "%s: %s\nRemote traceback:\n%s" % (self.excType, self.message, self.remoteTraceback)
+
 class PostThread(object):
   """Post callables to a separate thread, sending deferred results back to an Event Queue.
      Transforms a blocking API into an event-driven one!
   """
-  def __init__(self):
-    """Create a new thread to which requests may be posted"""
+  def __init__(self, priority=None):
+    """Create a new thread to which requests may be posted.
+       priority -- EventScheduler priority lane for the results (default: none, results are delivered
+                   through the scheduler's completion queue when it has one)
+    """
+    self.priority = priority
     self.serviceRequests = True
     self.reqQ = Queue.Queue()
     self.thread = threading.Thread(target=self._doRun)
@@ -95,22 +128,221 @@ class PostThread(object):
         # Terminate thread
         return
       
+      _runRequest(evQ, func, params, d, self.priority)
+
+
+def _runRequest(evQ, func, params, d, priority):
+  """Call func in the current thread and post its result or exc_info() to the Event Queue"""
+  try:
+    rv = func(*params)
+    err = False
+  except:
+    rv = sys.exc_info()
+    err = True
+  _postResult(evQ, priority, d, rv, err)
+
+def _postResult(evQ, priority, d, rv, err):
+  """Hand a result over to the Event Queue's thread"""
+  if priority is not None:
+    evQ.scheduleEvent(_qResult, [d, rv, err], priority=priority)
+  elif hasattr(evQ, 'postCompletion'):
+    # Batched delivery, cheaper than an event per result
+    evQ.postCompletion(_qResult, d, rv, err)
+  else:
+    evQ.scheduleEvent(_qResult, [d, rv, err])
+
+def _qResult(d, rv, err):
+  """Callback executor posted to the Event Queue"""
+  if err:
+    d.runErrback(rv)
+  else:
+    d.runCallback(rv)
+
+
+class PostThreadPool(object):
+  """Post callables to a pool of worker threads, sending deferred results back to an Event Queue.
+     Workers are started on demand up to maxWorkers and exit again after idleTimeout seconds
+     without work.  At most maxQueued requests wait for a free worker, beyond that post() raises
+     Queue.Full so producers can't pile up unbounded work.  It only blocks when asked to, which
+     must not be done on the event loop's thread: the loop would stall, and deadlock if the
+     queued work waits on it.
+  """
+  def __init__(self, maxWorkers=4, maxQueued=100, idleTimeout=60.0, priority=None):
+    """maxWorkers -- upper bound on the number of threads, None for no limit
+       maxQueued -- requests that may wait for a worker, 0 for no limit
+       idleTimeout -- seconds an idle worker waits for work before exiting, None to keep it forever
+       priority -- EventScheduler priority lane for the results (default: none, results are delivered
+                   through the scheduler's completion queue when it has one)
+    """
+    self.maxWorkers = maxWorkers
+    self.idleTimeout = idleTimeout
+    self.priority = priority
+    self.serviceRequests = True
+    self.reqQ = Queue.Queue(maxQueued)
+    self.lock = threading.Lock()
+    self.workers = 0
+    self.idle = 0
+    # Requests no worker has taken yet.  Unlike reqQ.qsize() it changes together with idle, under
+    # the lock, so a worker that just took a request is never counted as idle for the next one.
+    self.unclaimed = 0
+    # Metrics, see stats()
+    self.completed = 0
+    self.maxDepth = 0
+    self.waitTotal = 0.0
+    self.waitMax = 0.0
+
+  def post(self, evQ, func, params = [], block=False, timeout=None):
+    """Post the callable 'func' to be run by one of the pool's threads.
+       Returns Deferred object to which a callback may attached.
+       Deferred callback is posted to the given event queue with the return value of 'func'.
+
+       evQ -- Event Queue to which 'results' callback will be posted
+       func -- Function to execute in a worker thread
+       params -- arguments to func() (default [])
+       block, timeout -- what to do when the queue is full, as for Queue.put; Queue.Full is
+                         raised if no room was made in time, right away by default.  Never
+                         block on the event loop's thread.
+    """
+    if not self.serviceRequests:
+      raise PostThreadTerminated
+
+    d = Deferred.Deferred()
+    self.reqQ.put((evQ, func, params, d, time.time()), block, timeout)
+    with self.lock:
+      self.unclaimed += 1
+      depth = self.reqQ.qsize()
+      if depth > self.maxDepth:
+        self.maxDepth = depth
+      if self.unclaimed > self.idle and (self.maxWorkers is None or self.workers < self.maxWorkers):
+        self.workers += 1
+        self.idle += 1
+        worker = threading.Thread(target=self._doRun)
+        worker.setDaemon(True)
+        worker.start()
+    return d
+
+  def kill(self):
+    """Let the worker threads die, after pending requests are satisfied"""
+    self.serviceRequests = False
+    with self.lock:
+      workers = self.workers
+    for i in xrange(workers):
+      self.reqQ.put(None)
+
+  def stats(self):
+    """Return a dict of the pool's metrics:
+         workers and idle threads, requests 'queued' now, the deepest the queue has been
+         ('maxQueued'), requests 'completed', and their mean and max wait for a worker in seconds
+    """
+    with self.lock:
+      completed = self.completed
+      return {
+        'workers': self.workers,
+        'idle': self.idle,
+        'queued': self.reqQ.qsize(),
+        'maxQueued': self.maxDepth,
+        'completed': completed,
+        'meanWait': self.waitTotal / completed if completed else 0.0,
+        'maxWait': self.waitMax,
+      }
+
+  def _doRun(self):
+    """Worker thread main function"""
+    while True:
       try:
-        rv = func(*params)
-        err = False
-      except:
-        rv = sys.exc_info()
-        err = True
-      evQ.scheduleEvent(self._qResult, [d, rv, err])
-  
-  def _qResult(self, d, rv, err):  
-    """Callback executor posted to the Event Queue"""
-    if err:
-      d.runErrback(rv)
-    else:
-      d.runCallback(rv)
-    
-    
+        request = self.reqQ.get(True, self.idleTimeout)
+      except Queue.Empty:
+        with self.lock:
+          # Something may have been queued just after the timeout
+          if self.reqQ.empty():
+            self.workers -= 1
+            self.idle -= 1
+            return
+        continue
+      if request is None:
+        with self.lock:
+          self.workers -= 1
+          self.idle -= 1
+        return
+
+      (evQ, func, params, d, posted) = request
+      wait = time.time() - posted
+      with self.lock:
+        self.unclaimed -= 1
+        self.idle -= 1
+        self.waitTotal += wait
+        if wait > self.waitMax:
+          self.waitMax = wait
+      try:
+        _runRequest(evQ, func, params, d, self.priority)
+      finally:
+        with self.lock:
+          self.idle += 1
+          self.completed += 1
+
+
+def _callRemote(request):
+  """Worker process side of PostProcessPool: runs the pickled (func, params) request and returns
+     the pickled (err, result) pair.  Pickling here turns an unpicklable result into an error,
+     multiprocessing would drop it.
+  """
+  try:
+    func, params = cPickle.loads(request)
+    return cPickle.dumps((False, func(*params)), cPickle.HIGHEST_PROTOCOL)
+  except:
+    excType, exc, tb = sys.exc_info()
+    remoteTraceback = "".join(traceback.format_exception(excType, exc, tb))
+    del tb
+    return cPickle.dumps((True, (excType.__name__, str(exc), remoteTraceback)), cPickle.HIGHEST_PROTOCOL)
+
+class PostProcessPool(object):
+  """Post callables to a pool of worker processes, sending deferred results back to an Event Queue.
+     Like PostThread, but for CPU-bound work.  Errbacks get an exc_info() style tuple
+     (RemoteError, RemoteError instance, None), the RemoteError holding the remote traceback text.
+  """
+  def __init__(self, processes=None, priority=None, maxtasksperchild=None):
+    """processes -- number of worker processes (default: the number of CPUs)
+       priority -- EventScheduler priority lane for the results (default: none, results are delivered
+                   through the scheduler's completion queue when it has one)
+       maxtasksperchild -- replace a worker after this many calls (default: never)
+    """
+    self.priority = priority
+    self.serviceRequests = True
+    self.pool = multiprocessing.Pool(processes, maxtasksperchild=maxtasksperchild)
+
+  def post(self, evQ, func, params = []):
+    """Post the callable 'func' to be run in a worker process.
+       Returns Deferred object to which a callback may attached.
+       Deferred callback is posted to the given event queue with the return value of 'func'.
+
+       evQ -- Event Queue to which 'results' callback will be posted
+       func -- Module level function to execute in a worker process
+       params -- picklable arguments to func() (default [])
+       Raises the pickling error right away if func or params can't be pickled.
+    """
+    if not self.serviceRequests:
+      raise PostThreadTerminated
+    # Pickled here so that unpicklable arguments raise to the caller.  In the pool's task thread
+    # the failure would never reach the Deferred.
+    request = cPickle.dumps((func, params), cPickle.HIGHEST_PROTOCOL)
+
+    d = Deferred.Deferred()
+    def onResult(result):
+      # Runs on the pool's result thread, which also does the unpickling
+      err, rv = cPickle.loads(result)
+      if err:
+        error = RemoteError(*rv)
+        rv = (RemoteError, error, None)
+      _postResult(evQ, self.priority, d, rv, err)
+    self.pool.apply_async(_callRemote, (request,), callback=onResult)
+    return d
+
+  def kill(self):
+    """Let the worker processes exit, after pending requests are satisfied"""
+    self.serviceRequests = False
+    self.pool.close()
+
+
 #---------------------------------------------------------------------------------------------------
 if __name__=='__main__':
   logging.basicConfig()
@@ -140,9 +372,72 @@ if __name__=='__main__':
   pt1.kill()
   #pt1.post(evQ, foo, ['mo_param1', 'mo_param2']).addCallbacks(pt1cb)
 
-  while True:
-    evQ.poll()
-    time.sleep(0.1)
+  # 32 blocking calls of 50 msec each, on one PostThread and on a pool of 8 workers
+  def blocking(i):
+    time.sleep(0.05)
+    return i
+  for label, poster in (("PostThread", PostThread()), ("PostThreadPool(8)", PostThreadPool(maxWorkers=8, maxQueued=32))):
+    done = []
+    start = time.time()
+    for i in xrange(32):
+      poster.post(evQ, blocking, [i]).addCallbacks(done.append)
+    while len(done) < 32:
+      evQ.wait(0.01)
+      evQ.poll()
+    print "%-18s 32 blocking calls in %.2f sec" % (label, time.time() - start)
+    if isinstance(poster, PostThreadPool):
+      print "pool stats:", poster.stats()
+    poster.kill()
+
+  # CPU-bound work: timer lateness and total time while marshalling XML-RPC payloads on a
+  # PostThread and in a PostProcessPool.  Only the small request and reply strings are pickled.
+  import xmlrpclib
+  import zlib
+  def marshal(count):
+    return len(xmlrpclib.dumps(([{'id': i, 'name': 'node%d' % i, 'values': range(10)} for i in xrange(count)],)))
+  def ticker(lates, expected):
+    lates.append(evQ.time() - expected[0])
+    expected[0] = evQ.time() + 0.01
+    return 0.01
+  for label, poster in (("PostThread", PostThread()), ("PostProcessPool", PostProcessPool(2))):
+    done = []
+    lates = []
+    expected = [evQ.time() + 0.01]
+    tick = evQ.schedule(0.01, ticker, lates, expected)
+    start = time.time()
+    for i in xrange(8):
+      poster.post(evQ, marshal, [20000]).addCallbacks(done.append)
+    while len(done) < 8:
+      evQ.wait(0.01)
+      evQ.poll()
+    evQ.unschedule(tick)
+    print "%-16s 8 x xmlrpclib.dumps in %.2f sec, worst timer lateness %.1f msec" % (
+      label, time.time() - start, max(lates) * 1000)
+    poster.kill()
+
+  # 100000 tiny jobs, results delivered as one event each versus through the completion queue
+  def tiny(i):
+    return i
+  for label, poster in (("event per result", PostThread(priority=EventScheduler.PRIORITY_NORMAL)),
+                        ("completion queue", PostThread())):
+    done = []
+    start = time.time()
+    for i in xrange(100000):
+      poster.post(evQ, tiny, [i]).addCallbacks(done.append)
+    while len(done) < 100000:
+      evQ.wait(0.01)
+      evQ.poll()
+    elapsed = time.time() - start
+    print "%-16s 100000 tiny jobs in %.2f sec (%.0f jobs/sec)" % (label, elapsed, 100000 / elapsed)
+    poster.kill()
+
+  def remoteFailure(e):
+    print "remote error: %s" % (e[1].remoteTraceback.splitlines()[-1])
+  pool = PostProcessPool(1)
+  pool.post(evQ, zlib.decompress, ["not compressed"]).addCallbacks(pt1cb, remoteFailure)
+  pool.kill()
+
+  evQ.run()
 
 
 #---------------------------------------------------------------------------------------------------
@@ -47,6 +47,7 @@ There exists a live host running this web server: nada.ics.uci.edu
 
 import asynchat, asyncore, socket, SimpleHTTPServer
 import sys, cgi, cStringIO, os, traceback, zlib, optparse
+import reactor
 
 __version__ = ".4"
 
@@ -510,4 +511,4 @@ if __name__=="__main__":
     req_handler = which[options.server]
     s=Server('',options.port,req_handler)
     print req_handler.__name__, "running on port", options.port, "with root path", options.root
-    asyncore.loop()
+    reactor.loop()
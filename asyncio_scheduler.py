@@ -0,0 +1,177 @@
+"""Emulates the apy EventScheduler API on an asyncio event loop.
+
+Every event is a loop.call_at timer handle, so unscheduling one is an O(1) TimerHandle.cancel()
+and asyncio compacts the cancelled handles itself.  Like EventScheduler, scheduling and
+unscheduling work from any thread: off the loop's thread they are handed over with
+call_soon_threadsafe, which also wakes the loop up.
+
+Usage:
+------
+sked = AsyncioScheduler(loop)
+event = sked.schedule(5.0, callable, arg)   # return True or a new delay to be called again
+sked.unschedule(event)                      # or event.Stop()
+"""
+
+
+import thread
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+
+class AsyncioEventElement(object):
+    def __init__(self, scheduler, func, delay=0.0, *args, **kwargs):
+        self.scheduler = scheduler
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.delay = delay
+        self.fireTime = scheduler.time() + delay
+        self.cancelled = False
+        self._running = True
+        self._handle = None # asyncio.TimerHandle, loop thread only
+
+    def run(self):
+        self._handle = None
+        if self.cancelled:
+            # Unscheduled from another thread after it became due, before _cancel got here
+            return
+        value = self.func(*self.args, **self.kwargs)
+        reschedule = False
+        if isinstance(value, bool):
+            # bool inherits from int
+            reschedule = value
+        elif isinstance(value, float) or isinstance(value, int):
+            self.delay = value
+            reschedule = True
+        if reschedule and not self.cancelled:
+            self.fireTime = self.scheduler.time() + self.delay
+            self._handle = self.scheduler.loop.call_at(self.fireTime, self.run)
+        else:
+            self._running = False
+
+    def start(self):
+        """Schedule the event again after it was stopped, 'delay' seconds from now"""
+        self.fireTime = self.scheduler.time() + self.delay
+        self.scheduler._submit(self)
+
+    def Stop(self, *args, **kwargs):
+        self.scheduler.unschedule(self)
+
+    stop = Stop
+
+
+class AsyncioScheduler(object):
+    """EventScheduler API on top of an asyncio event loop, the current one by default"""
+    def __init__(self, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.time = loop.time
+
+    def _onLoopThread(self):
+        # _thread_id is private, but read on purpose: asyncio has no public way to ask whether a
+        # loop runs on the current thread.  run_forever() sets it for as long as the loop runs, in
+        # asyncio, trollius and uvloop alike.  Should it go away, everything takes the
+        # call_soon_threadsafe path, which is slower but still correct.
+        return getattr(self.loop, '_thread_id', None) == thread.get_ident()
+
+    def _submit(self, event):
+        event.cancelled = False
+        event._running = True
+        if self._onLoopThread():
+            self._start(event)
+        else:
+            self.loop.call_soon_threadsafe(self._start, event)
+
+    def _start(self, event):
+        """Arm the event's timer, loop thread only"""
+        if event.cancelled:
+            return # Unscheduled before the hand-over got here
+        if event._handle is not None:
+            # Restarted while it was still pending or being rescheduled
+            event._handle.cancel()
+        event._handle = self.loop.call_at(event.fireTime, event.run)
+
+    def _cancel(self, event):
+        if event._handle is not None:
+            event._handle.cancel()
+            event._handle = None
+
+    def schedule(self, delay, callable, *args, **kwargs):
+        """Emulates the EventScheduler.schedule API"""
+        event = AsyncioEventElement(self, callable, delay, *args, **kwargs)
+        self._submit(event)
+        return event
+
+    def scheduleEvent(self, func, params=[], delay=0.0, priority=None):
+        """Emulates the EventScheduler.scheduleEvent API.
+           priority is accepted for compatibility and ignored, asyncio runs due timers in order.
+        """
+        event = AsyncioEventElement(self, func, delay, *params)
+        self._submit(event)
+        return event
+
+    def postCompletion(self, func, *args):
+        """Emulates the EventScheduler.postCompletion API: call func(*args) on the loop thread"""
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def unschedule(self, event):
+        """Removes the scheduled event from the loop.
+           Also stops an event from being rescheduled if it is currently running.
+        """
+        if event.scheduler is not self:
+            return # No need to error if it is not in the queue
+        event.cancelled = True
+        event._running = False
+        if self._onLoopThread():
+            self._cancel(event)
+        else:
+            self.loop.call_soon_threadsafe(self._cancel, event)
+
+    @classmethod
+    def instance(cls):
+        """Returns a global AsyncioScheduler instance."""
+        if not hasattr(cls, "_instance"):
+            cls._instance = cls()
+        return cls._instance
+
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # Cost of scheduling and unscheduling idle timeouts, on and off the loop thread
+    import threading
+    import time
+
+    count = 100000
+    loop = asyncio.new_event_loop()
+    sked = AsyncioScheduler(loop)
+
+    def noop():
+        pass
+
+    def onLoop():
+        start = time.time()
+        events = [sked.schedule(60.0, noop) for i in xrange(count)]
+        for event in events:
+            event.Stop()
+        print "loop thread   %.2f usec per schedule + unschedule" % ((time.time() - start) / count * 1e6)
+        loop.stop()
+    loop.call_soon(onLoop)
+    loop.run_forever()
+
+    loopThread = threading.Thread(target=loop.run_forever)
+    loopThread.start()
+    start = time.time()
+    events = [sked.schedule(60.0, noop) for i in xrange(count)]
+    for event in events:
+        event.Stop()
+    finished = threading.Event()
+    sked.postCompletion(finished.set)
+    finished.wait()
+    print "other thread  %.2f usec per schedule + unschedule" % ((time.time() - start) / count * 1e6)
+    loop.call_soon_threadsafe(loop.stop)
+    loopThread.join()
+    loop.close()
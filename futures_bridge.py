@@ -0,0 +1,287 @@
+"""Adapters between apy Deferreds and concurrent.futures / asyncio futures.
+
+A Deferred lives on the thread of its EventScheduler, a concurrent.futures.Future on whichever
+thread completes it, and an asyncio.Future on the thread of its event loop.  The adapters never
+block and start no threads: each result is handed over with a single wake-up of the receiving
+side, EventScheduler.postCompletion for Deferreds and loop.call_soon_threadsafe for asyncio.
+Cancellation is passed on in both directions, so cancelling the Deferred of an RPC cancels the
+asyncio task waiting for it and vice versa.
+
+Deferred APIs, such as an XML-RPC proxy, may only be used on the scheduler's thread.  Other
+threads and coroutines hand the call over with postCompletion, or callFromAsyncio.
+
+Usage:
+------
+# On the scheduler's thread
+d = fromConcurrentFuture(executor.submit(work), evScheduler)
+d = fromAsyncioFuture(asyncio.run_coroutine_threadsafe(coro, loop), evScheduler)
+future = toConcurrentFuture(proxy.method(), evScheduler)    # future.result() on a worker thread
+# Inside a coroutine on loop, the call is made on the scheduler's thread
+result = await callFromAsyncio(evScheduler, loop, proxy.method, arg)
+
+concurrent.futures is the 'futures' backport on Python 2, asyncio the 'trollius' backport.
+"""
+
+
+import functools
+import sys
+
+import Deferred
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+
+def _post(scheduler, func, *args):
+    """Have the scheduler's loop thread call func(*args)"""
+    if hasattr(scheduler, 'postCompletion'):
+        scheduler.postCompletion(func, *args)
+    else:
+        scheduler.scheduleEvent(func, list(args))
+
+
+def _result(args):
+    """The value a Deferred callback was called with, the way DeferredList reports it"""
+    if len(args) == 1:
+        return args[0]
+    return args
+
+
+def _exception(args):
+    """The exception instance behind the arguments of a Deferred errback"""
+    error = _result(args)
+    if isinstance(error, tuple) and len(error) == 3 and isinstance(error[1], BaseException):
+        error = error[1] # sys.exc_info()
+    if not isinstance(error, BaseException):
+        error = Exception(error)
+    return error
+
+
+def _copyFuture(future, d):
+    """Fire d with the outcome of the completed future, loop thread only"""
+    if d.called or d.errored:
+        return # The Deferred was cancelled first
+    if future.cancelled():
+        d.runErrback(Deferred.CancelledError("Future cancelled"))
+        return
+    error = future.exception()
+    if error is None:
+        d.runCallback(future.result())
+    else:
+        d.runErrback((type(error), error, getattr(error, '__traceback__', None)))
+
+
+#---------------------------------------------------------------------------------------------------
+# concurrent.futures
+
+def fromConcurrentFuture(future, scheduler):
+    """Return a Deferred fired on the scheduler's loop thread with the outcome of the future.
+       Errbacks get an exc_info() style tuple.  Cancelling the Deferred cancels the future,
+       which only succeeds while its work hasn't started.
+    """
+    d = Deferred.Deferred(lambda deferred: future.cancel())
+    future.add_done_callback(functools.partial(_concurrentDone, scheduler, d))
+    return d
+
+def _concurrentDone(scheduler, d, future):
+    # Runs on the thread that completed the future, or right away if it already was
+    _post(scheduler, _copyFuture, future, d)
+
+
+def toConcurrentFuture(d, scheduler=None):
+    """Return a concurrent.futures.Future completed with the outcome of the Deferred.
+       Given the Deferred's scheduler, the future's callbacks are added to the Deferred on the
+       scheduler's loop thread, so this can be called from any thread, and cancelling the future
+       cancels the Deferred.  Without it, call this on the Deferred's own thread.  Never wait on
+       the future from the loop thread, that would deadlock the loop.
+    """
+    future = futures.Future()
+    if scheduler is None:
+        _addConcurrentCallbacks(d, future)
+    else:
+        future.add_done_callback(functools.partial(_concurrentCancelled, scheduler, d))
+        _post(scheduler, _addConcurrentCallbacks, d, future)
+    return future
+
+def _addConcurrentCallbacks(d, future):
+    d.addCallbacks(functools.partial(_setConcurrentResult, future),
+                   functools.partial(_setConcurrentException, future))
+
+def _setConcurrentResult(future, *args):
+    result = _result(args)
+    # Once running the future can no longer be cancelled by another thread
+    if future.set_running_or_notify_cancel():
+        future.set_result(result)
+    return result
+
+def _setConcurrentException(future, *args):
+    if future.set_running_or_notify_cancel():
+        future.set_exception(_exception(args))
+    # Handed over to the future, so it doesn't count as unhandled here
+
+def _concurrentCancelled(scheduler, d, future):
+    if future.cancelled():
+        _post(scheduler, d.cancel)
+
+
+#---------------------------------------------------------------------------------------------------
+# asyncio
+
+def fromAsyncioFuture(future, scheduler):
+    """Return a Deferred fired on the scheduler's loop thread with the outcome of the asyncio
+       future or task.  Errbacks get an exc_info() style tuple.  Cancelling the Deferred cancels
+       the future on its event loop.  For a coroutine running on another thread's loop, pass
+       asyncio.run_coroutine_threadsafe(coro, loop) to fromConcurrentFuture instead.
+    """
+    loop = _loopOf(future)
+    d = Deferred.Deferred(lambda deferred: loop.call_soon_threadsafe(future.cancel))
+    # asyncio futures may only be touched from their loop's thread
+    loop.call_soon_threadsafe(future.add_done_callback, functools.partial(_asyncioDone, scheduler, d))
+    return d
+
+def _asyncioDone(scheduler, d, future):
+    _post(scheduler, _copyFuture, future, d)
+
+def _loopOf(future):
+    getLoop = getattr(future, 'get_loop', None)
+    if getLoop is not None:
+        return getLoop()
+    return future._loop # Before Python 3.7
+
+
+def toAsyncioFuture(d, loop, scheduler=None):
+    """Return an asyncio future of loop, completed on the loop's thread with the outcome of the
+       Deferred, so a coroutine can await the Deferred.  Given the Deferred's scheduler, the
+       future's callbacks are added to the Deferred on the scheduler's loop thread, and
+       cancelling the future cancels the Deferred.  Without it, call this on the Deferred's own
+       thread.
+    """
+    future = asyncio.Future(loop=loop)
+    if scheduler is None:
+        _addAsyncioCallbacks(d, loop, future)
+    else:
+        # Safe from this thread only as long as nothing has been handed to the loop
+        future.add_done_callback(functools.partial(_asyncioCancelled, scheduler, d))
+        _post(scheduler, _addAsyncioCallbacks, d, loop, future)
+    return future
+
+def callFromAsyncio(scheduler, loop, func, *args):
+    """Call func(*args) on the scheduler's loop thread and return an asyncio future of loop for
+       the Deferred it returns; a plain return value or exception completes the future as is.
+       For coroutines using Deferred APIs.  Cancelling the future cancels the Deferred.
+    """
+    future = asyncio.Future(loop=loop)
+    _post(scheduler, _callForAsyncio, scheduler, loop, future, func, args)
+    return future
+
+def _callForAsyncio(scheduler, loop, future, func, args):
+    try:
+        rv = func(*args)
+    except:
+        loop.call_soon_threadsafe(_completeAsyncio, future, True, sys.exc_info()[1])
+        return
+    if not isinstance(rv, Deferred.Deferred):
+        loop.call_soon_threadsafe(_completeAsyncio, future, False, rv)
+        return
+    # The coroutine may be awaiting the future already, so it is only touched on its loop
+    loop.call_soon_threadsafe(future.add_done_callback, functools.partial(_asyncioCancelled, scheduler, rv))
+    _addAsyncioCallbacks(rv, loop, future)
+
+def _addAsyncioCallbacks(d, loop, future):
+    d.addCallbacks(functools.partial(_setAsyncioResult, loop, future),
+                   functools.partial(_setAsyncioException, loop, future))
+
+def _setAsyncioResult(loop, future, *args):
+    result = _result(args)
+    loop.call_soon_threadsafe(_completeAsyncio, future, False, result)
+    return result
+
+def _setAsyncioException(loop, future, *args):
+    loop.call_soon_threadsafe(_completeAsyncio, future, True, _exception(args))
+
+def _completeAsyncio(future, failed, value):
+    # On the event loop thread, where nothing can cancel the future behind our back
+    if future.done():
+        return
+    if failed:
+        future.set_exception(value)
+    else:
+        future.set_result(value)
+
+def _asyncioCancelled(scheduler, d, future):
+    if future.cancelled():
+        _post(scheduler, d.cancel)
+
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # Conversions per second in each direction, including the wake-up of the other side
+    import threading
+    import time
+
+    import EventScheduler
+
+    count = 20000
+    sked = EventScheduler.EventScheduler()
+
+    if futures is not None:
+        done = []
+        start = time.time()
+        for i in xrange(count):
+            future = futures.Future()
+            fromConcurrentFuture(future, sked).addCallback(done.append)
+            future.set_result(i)
+        while len(done) < count:
+            sked.poll()
+        print "concurrent.futures -> Deferred %9.0f per sec" % (count / (time.time() - start))
+
+        start = time.time()
+        for i in xrange(count):
+            d = Deferred.Deferred()
+            future = toConcurrentFuture(d)
+            d.runCallback(i)
+            future.result()
+        print "Deferred -> concurrent.futures %9.0f per sec" % (count / (time.time() - start))
+
+    if asyncio is not None:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        done = []
+        start = time.time()
+        for i in xrange(count):
+            future = asyncio.Future(loop=loop)
+            fromAsyncioFuture(future, sked).addCallback(done.append)
+            loop.call_soon_threadsafe(future.set_result, i)
+        while len(done) < count:
+            sked.poll()
+        print "asyncio -> Deferred            %9.0f per sec" % (count / (time.time() - start))
+
+        futuresDone = threading.Event()
+        results = []
+        def collect(future):
+            results.append(future.result())
+            if len(results) == count:
+                futuresDone.set()
+        start = time.time()
+        for i in xrange(count):
+            d = Deferred.Deferred()
+            toAsyncioFuture(d, loop).add_done_callback(collect)
+            d.runCallback(i)
+        futuresDone.wait()
+        print "Deferred -> asyncio            %9.0f per sec" % (count / (time.time() - start))
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
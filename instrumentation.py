@@ -0,0 +1,289 @@
+"""Per-callback statistics for the apy EventScheduler.
+
+Records, for every callable the scheduler runs, how late it fired (start of the call minus its
+fireTime), how long it ran and how often it was rescheduled.  Times go into fixed-size log2
+histograms, so the memory used per callable doesn't grow however long the process runs.
+
+Usage:
+------
+stats = SchedulerStats(evScheduler)     # starts recording
+...
+print stats.toJSON(indent=2)
+stats.detach()                          # back to zero overhead
+
+Watchdog is a second monitor that catches a single callback blocking the loop thread, which
+stalls every timer and all socket I/O with it.  It logs the stack of the loop thread while the
+callback is still running, so the culprit line shows up even if the callback never returns.
+"""
+
+
+import json
+import logging
+import sys
+import thread
+import threading
+import traceback
+
+
+log = logging.getLogger("apy.%s" % (__name__))
+
+
+HISTOGRAM_BUCKETS = 32 # Bucket i counts values below 2**i microseconds, the last one everything above
+
+
+def callableName(func):
+    """Return a readable and stable name for func, used as the statistics key"""
+    self = getattr(func, 'im_self', None)
+    if self is None:
+        self = getattr(func, '__self__', None)
+    name = getattr(func, '__name__', None)
+    if name is None:
+        # A callable instance
+        return "%s.%s" % (type(func).__module__, type(func).__name__)
+    if self is not None and not isinstance(self, type):
+        return "%s.%s.%s" % (type(self).__module__, type(self).__name__, name)
+    module = getattr(func, '__module__', None)
+    if module:
+        return "%s.%s" % (module, name)
+    return name
+
+
+class Histogram(object):
+    """Fixed memory histogram of durations in seconds with power of two microsecond buckets"""
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds < 0.0:
+            seconds = 0.0 # Events that ran early, only possible with a coarse clock
+        index = int(seconds * 1e6).bit_length()
+        if index >= HISTOGRAM_BUCKETS:
+            index = HISTOGRAM_BUCKETS - 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Return the upper bound in seconds of the bucket holding the given percentile"""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def toDict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets_usec': self.buckets[:],
+        }
+
+
+class CallableStats(object):
+    __slots__ = ('calls', 'reschedules', 'lateness', 'runtime')
+
+    def __init__(self):
+        self.calls = 0
+        self.reschedules = 0
+        self.lateness = Histogram()
+        self.runtime = Histogram()
+
+    def toDict(self):
+        return {
+            'calls': self.calls,
+            'reschedules': self.reschedules,
+            'lateness': self.lateness.toDict(),
+            'runtime': self.runtime.toDict(),
+        }
+
+
+class SchedulerStats(object):
+    """Scheduler monitor collecting a CallableStats per callable name.
+       Recording happens on the loop thread; the query methods can be used from any thread.
+    """
+    def __init__(self, scheduler=None):
+        self.stats = {} # callableName -> CallableStats
+        self.lock = threading.Lock()
+        self.scheduler = None
+        self._lateness = 0.0
+        if scheduler is not None:
+            self.attach(scheduler)
+
+    def attach(self, scheduler):
+        """Start recording the events run by scheduler"""
+        self.detach()
+        self.scheduler = scheduler
+        scheduler.monitors.append(self)
+
+    def detach(self):
+        """Stop recording, the statistics gathered so far are kept"""
+        if self.scheduler is not None:
+            self.scheduler.monitors.remove(self)
+            self.scheduler = None
+
+    def eventStarted(self, event, started):
+        # fireTime has moved on by eventFinished if the event was rescheduled
+        self._lateness = started - event.fireTime
+
+    def eventFinished(self, event, started, finished, rescheduled):
+        name = callableName(event.func)
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = CallableStats()
+            stats.calls += 1
+            if rescheduled:
+                stats.reschedules += 1
+            stats.lateness.add(self._lateness)
+            stats.runtime.add(finished - started)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def snapshot(self):
+        """Return the statistics as a dict of plain dicts, keyed by callable name"""
+        with self.lock:
+            return dict((name, stats.toDict()) for name, stats in self.stats.iteritems())
+
+    def toJSON(self, **kwargs):
+        """Return snapshot() as JSON, kwargs are passed on to json.dumps"""
+        return json.dumps(self.snapshot(), sort_keys=True, **kwargs)
+
+    def slowest(self, count=10):
+        """Return the (name, CallableStats dict) of the callables with the largest total runtime"""
+        items = self.snapshot().items()
+        items.sort(key=lambda item: item[1]['runtime']['mean'] * item[1]['calls'], reverse=True)
+        return items[:count]
+
+
+class Watchdog(object):
+    """Scheduler monitor with a thread that reports callbacks running longer than 'threshold' seconds.
+       Each overrun is logged once, as a warning with the loop thread's stack, and counted per
+       callable name in 'overruns'.  'interval' is how often the thread looks, threshold / 2 by default.
+    """
+    def __init__(self, scheduler=None, threshold=0.5, interval=None):
+        self.threshold = threshold
+        if interval is None:
+            interval = threshold / 2.0
+        self.interval = interval
+        self.overruns = {} # callableName -> count
+        self.scheduler = None
+        # (event, started, thread id, call number) of the callback being run, replaced as a whole
+        # so the watchdog thread always sees a consistent tuple
+        self._current = None
+        self._calls = 0
+        self._reported = None
+        self._stopped = threading.Event()
+        self._thread = None
+        if scheduler is not None:
+            self.attach(scheduler)
+
+    def attach(self, scheduler):
+        """Start watching the callbacks run by scheduler"""
+        self.detach()
+        self.scheduler = scheduler
+        scheduler.monitors.append(self)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name="apy watchdog")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def detach(self):
+        """Stop watching and wait for the watchdog thread to exit"""
+        if self.scheduler is not None:
+            self.scheduler.monitors.remove(self)
+            self.scheduler = None
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._current = None
+
+    def eventStarted(self, event, started):
+        self._calls += 1
+        self._current = (event, started, thread.get_ident(), self._calls)
+
+    def eventFinished(self, event, started, finished, rescheduled):
+        self._current = None
+
+    def _watch(self):
+        scheduler = self.scheduler
+        while not self._stopped.wait(self.interval):
+            current = self._current
+            if current is None:
+                continue
+            event, started, threadId, call = current
+            elapsed = scheduler.time() - started
+            if elapsed < self.threshold or call == self._reported:
+                continue
+            self._reported = call
+            name = callableName(event.func)
+            self.overruns[name] = self.overruns.get(name, 0) + 1
+            frame = sys._current_frames().get(threadId)
+            if frame is None:
+                stack = "  (stack not available)\n"
+            else:
+                stack = "".join(traceback.format_stack(frame))
+                del frame
+            log.warning("%s has been blocking the event loop for %.3f sec:\n%s", name, elapsed, stack)
+
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # Overhead of recording, compared to the same poll loop with no monitor attached
+    import time
+
+    import EventScheduler
+
+    def tick():
+        return True
+
+    def slow():
+        time.sleep(0.002)
+
+    sked = EventScheduler.EventScheduler()
+    for i in xrange(1000):
+        sked.scheduleEvent(tick)
+    for label, stats in (("disabled", None), ("enabled", SchedulerStats())):
+        if stats is not None:
+            stats.attach(sked)
+        start = time.time()
+        for i in xrange(200):
+            sked.poll()
+        elapsed = time.time() - start
+        print "monitoring %-8s %.2f usec per event" % (label, elapsed / 200000 * 1e6)
+
+    for i in xrange(20):
+        sked.schedule(0.001 * i, slow)
+    while sked.liveCount > 1000:
+        sked.poll()
+    print stats.toJSON()
+    stats.detach()
+
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)-8s %(name)s %(message)s')
+    watchdog = Watchdog(sked, threshold=0.1)
+    def blocking():
+        time.sleep(0.3)
+    sked.scheduleEvent(blocking)
+    sked.poll()
+    watchdog.detach()
+    print "overruns:", watchdog.overruns
@@ -4,18 +4,77 @@
 
 from __future__ import division
 
-__all__ = ["monotonic_time"]
+__all__ = ["monotonic_time", "monotonic_ns"]
 
-import ctypes
 import os
 import sys
+import threading
 import time
 
 
 LINUX_LIBRT = 'librt.so.1'
 
+CLOCK_MONOTONIC = 1 # see <linux/time.h>
+CLOCK_MONOTONIC_RAW = 4 # see /usr/include/linux/time.h in Ubuntu
 
-if sys.platform == "win32":
+
+def _ctypes_clock(clock_id=CLOCK_MONOTONIC):
+    """Return (seconds, nanoseconds) functions reading clock_id through a cached ctypes binding.
+       Each thread gets its own timespec so concurrent callers don't clobber each other.
+       CLOCK_MONOTONIC is the default since it is served from the vDSO without a system call,
+       which CLOCK_MONOTONIC_RAW is not on many kernels.
+    """
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [
+            ('tv_sec', ctypes.c_long),
+            ('tv_nsec', ctypes.c_long)
+        ]
+
+    try:
+        lib = ctypes.CDLL(LINUX_LIBRT, use_errno=True)
+    except OSError:
+        # Newer glibc and OS X keep clock_gettime in libc itself
+        lib = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    clock_gettime = lib.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_gettime.restype = ctypes.c_int
+    local = threading.local()
+
+    def _read():
+        try:
+            ts, ref = local.timespec
+        except AttributeError:
+            ts = timespec()
+            ref = ctypes.byref(ts)
+            local.timespec = (ts, ref)
+        if clock_gettime(clock_id, ref) != 0:
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_))
+        return ts
+
+    def monotonic_time():
+        ts = _read()
+        return ts.tv_sec + ts.tv_nsec / 1e9
+
+    def monotonic_ns():
+        ts = _read()
+        return ts.tv_sec * 1000000000 + ts.tv_nsec
+
+    return monotonic_time, monotonic_ns
+
+
+if hasattr(time, "monotonic"):
+    # Python 3.3+ already does the right thing for every platform, in C
+    monotonic_time = time.monotonic
+    if hasattr(time, "monotonic_ns"):
+        monotonic_ns = time.monotonic_ns
+    else:
+        def monotonic_ns():
+            return int(time.monotonic() * 1e9)
+elif sys.platform == "win32":
     #import ctypes.wintypes
 
     #if sys.getwindowsversion()[0] >= 6:
@@ -37,30 +96,32 @@ if sys.platform == "win32":
 
     # According to the python docs time.clock on Windows uses QueryPerformanceCounter
     # which should give us the best accuracy and precision
-    def monotonic_time():
-        return time.clock()
+    monotonic_time = time.clock
+
+    def monotonic_ns():
+        return int(time.clock() * 1e9)
 else:
-    CLOCK_MONOTONIC = 1 # see <linux/time.h>
-    CLOCK_MONOTONIC_RAW = 4 # see /usr/include/linux/time.h in Ubuntu
-    class timespec(ctypes.Structure):
-        _fields_ = [
-            ('tv_sec', ctypes.c_long),
-            ('tv_nsec', ctypes.c_long)
-        ]
-    librt = ctypes.CDLL(LINUX_LIBRT, use_errno=True)
-    clock_gettime = librt.clock_gettime
-    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
-    clock_gettime.restype = ctypes.c_int
-    g_timespec = timespec()
-    def monotonic_time():
-        if clock_gettime(CLOCK_MONOTONIC_RAW, ctypes.byref(g_timespec)) != 0:
-            errno_ = ctypes.get_errno()
-            raise OSError(errno_, os.strerror(errno_))
-        return g_timespec.tv_sec + g_timespec.tv_nsec / 1e9
+    monotonic_time, monotonic_ns = _ctypes_clock(CLOCK_MONOTONIC)
 
 
 if __name__ == "__main__":
     import timeit
 
+    # Cost per call of each clock source
+    clocks = [("time.time", time.time), ("timeit.default_timer", timeit.default_timer),
+              ("monotime.monotonic_time", monotonic_time), ("monotime.monotonic_ns", monotonic_ns)]
+    for name in ("monotonic", "monotonic_ns", "perf_counter"):
+        if hasattr(time, name):
+            clocks.append(("time." + name, getattr(time, name)))
+    if sys.platform != "win32":
+        for name, clock_id in (("MONOTONIC", CLOCK_MONOTONIC), ("MONOTONIC_RAW", CLOCK_MONOTONIC_RAW)):
+            seconds, nanoseconds = _ctypes_clock(clock_id)
+            clocks.append(("ctypes CLOCK_%s" % name, seconds))
+            clocks.append(("ctypes CLOCK_%s ns" % name, nanoseconds))
+    for name, clock in clocks:
+        calls = 1000000
+        cost = timeit.Timer(clock).timeit(calls) / calls
+        print "%-28s %6.3f usec per call" % (name, cost * 1e6)
+
     while True:
         print timeit.default_timer(), monotonic_time()
@@ -0,0 +1,348 @@
+"""Single event loop driving both asyncore dispatchers and EventScheduler timers.
+
+Instead of interleaving asyncore.poll(someTimeout) and EventScheduler.poll() by hand, a Reactor
+blocks in select/epoll exactly until the earliest timer is due, dispatches whatever I/O became
+ready, then runs the due timers.  Scheduling an earlier timer from another thread wakes it up
+through the scheduler's Waker.
+
+Usage:
+------
+reactor = Reactor(evScheduler)
+reactor.run()       # until reactor.stop()
+
+For pure socket servers loop() is a drop-in replacement for asyncore.loop().  All pollers
+keep the asyncore dispatcher contract (readable/writable/handle_*), but PollPoller and
+EpollPoller are not capped at FD_SETSIZE descriptors the way select() is.
+"""
+
+
+import asyncore
+import errno
+import math
+import select
+import socket
+import time
+
+import EventScheduler
+
+
+def readwrite(obj, flags, map, fd):
+    """asyncore.readwrite, except that it stops once a handler has closed the dispatcher.
+       Otherwise a read that finds EOF closes it, and the POLLHUP that came with the data
+       calls handle_close() a second time on a closed socket.
+    """
+    try:
+        if flags & select.POLLIN:
+            obj.handle_read_event()
+            if map.get(fd) is not obj:
+                return
+        if flags & select.POLLOUT:
+            obj.handle_write_event()
+            if map.get(fd) is not obj:
+                return
+        if flags & select.POLLPRI:
+            obj.handle_expt_event()
+            if map.get(fd) is not obj:
+                return
+        if flags & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+            obj.handle_close()
+    except socket.error, e:
+        if e.args[0] not in asyncore._DISCONNECTED:
+            obj.handle_error()
+        else:
+            obj.handle_close()
+    except asyncore._reraised_exceptions:
+        raise
+    except:
+        obj.handle_error()
+
+
+class SelectPoller(object):
+    """Portable poller, the same select() loop asyncore.poll uses"""
+    def poll(self, timeout, map, waker=None):
+        r = []
+        if waker is not None:
+            r.append(waker)
+        w = []
+        e = []
+        for fd, obj in map.items():
+            is_r = obj.readable()
+            is_w = obj.writable()
+            if is_r:
+                r.append(fd)
+            # accepting sockets should not be writable
+            if is_w and not obj.accepting:
+                w.append(fd)
+            if is_r or is_w:
+                e.append(fd)
+
+        if not (r or w or e):
+            # Windows select() refuses three empty lists
+            if timeout:
+                time.sleep(timeout)
+            return
+
+        try:
+            r, w, e = select.select(r, w, e, timeout)
+        except select.error, err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+
+        for fd in r:
+            if fd is waker:
+                waker.drain()
+                continue
+            obj = map.get(fd)
+            if obj is not None:
+                asyncore.read(obj)
+        for fd in w:
+            obj = map.get(fd)
+            if obj is not None:
+                asyncore.write(obj)
+        for fd in e:
+            obj = map.get(fd)
+            if obj is not None:
+                asyncore._exception(obj)
+
+    def close(self):
+        pass
+
+
+class _RegisteringPoller(object):
+    """Base for pollers that keep a persistent registration per file descriptor.
+       Registrations are only changed when a dispatcher's readable()/writable() answer changes.
+    """
+    def __init__(self):
+        # Looked up here since Windows has no poll constants at all
+        self.READ = select.POLLIN | select.POLLPRI
+        self.WRITE = select.POLLOUT
+        self.registered = {} # fd -> (eventmask, dispatcher)
+        self.wakerFd = None
+
+    def _update(self, fd, flags, obj):
+        current = self.registered.get(fd)
+        if current is not None:
+            if current[0] == flags and current[1] is obj:
+                return
+            if current[1] is obj:
+                try:
+                    self.pollster.modify(fd, flags)
+                    self.registered[fd] = (flags, obj)
+                    return
+                except IOError:
+                    pass # Closed behind our back, register it again below
+            self._unregister(fd)
+        self.pollster.register(fd, flags)
+        self.registered[fd] = (flags, obj)
+
+    def _unregister(self, fd):
+        del self.registered[fd]
+        try:
+            self.pollster.unregister(fd)
+        except (IOError, KeyError, ValueError):
+            pass # The socket was already closed, which removed it from an epoll set
+
+    def _wait(self, timeout):
+        raise NotImplementedError
+
+    def poll(self, timeout, map, waker=None):
+        if waker is not None and self.wakerFd is None:
+            self.wakerFd = waker.fileno()
+            self.pollster.register(self.wakerFd, self.READ)
+
+        registered = self.registered
+        for fd, obj in map.items():
+            flags = 0
+            if obj.readable():
+                flags |= self.READ
+            # accepting sockets should not be writable
+            if obj.writable() and not obj.accepting:
+                flags |= self.WRITE
+            if flags:
+                self._update(fd, flags, obj)
+            elif fd in registered:
+                self._unregister(fd)
+        if len(registered) > len(map):
+            for fd in [fd for fd in registered if fd not in map]:
+                self._unregister(fd)
+
+        try:
+            events = self._wait(timeout)
+        except (IOError, select.error), err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+
+        for fd, flags in events:
+            if fd == self.wakerFd:
+                waker.drain()
+                continue
+            obj = map.get(fd)
+            if obj is not None:
+                # epoll and poll share the same flag values on Linux
+                readwrite(obj, flags, map, fd)
+
+    def close(self):
+        pass
+
+
+class PollPoller(_RegisteringPoller):
+    """poll() based poller, not limited to FD_SETSIZE descriptors like select()"""
+    def __init__(self):
+        _RegisteringPoller.__init__(self)
+        self.pollster = select.poll()
+
+    def _wait(self, timeout):
+        if timeout is not None:
+            # poll() takes milliseconds, round up so we don't spin just short of a deadline
+            timeout = int(math.ceil(timeout * 1000))
+        return self.pollster.poll(timeout)
+
+
+class EpollPoller(_RegisteringPoller):
+    """Level-triggered epoll poller for Linux, the kernel side costs O(ready sockets).
+       Edge-triggered mode is not offered: asyncore handlers read only once per
+       readiness notification, so they would leave data stranded in the socket.
+    """
+    def __init__(self):
+        _RegisteringPoller.__init__(self)
+        self.pollster = select.epoll()
+
+    def _wait(self, timeout):
+        if timeout is None:
+            timeout = -1
+        return self.pollster.poll(timeout)
+
+    def close(self):
+        self.pollster.close()
+
+
+def bestPoller():
+    """Return an instance of the most scalable poller available on this platform"""
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    if hasattr(select, 'poll'):
+        return PollPoller()
+    return SelectPoller()
+
+
+def loop(timeout=30.0, map=None, count=None, poller=None):
+    """Drop-in replacement for asyncore.loop() using bestPoller() by default"""
+    if map is None:
+        map = asyncore.socket_map
+    if poller is None:
+        poller = bestPoller()
+
+    try:
+        if count is None:
+            while map:
+                poller.poll(timeout, map)
+        else:
+            while map and count > 0:
+                poller.poll(timeout, map)
+                count -= 1
+    finally:
+        poller.close()
+
+
+class Reactor(object):
+    """Dispatches asyncore I/O and EventScheduler timers from one loop.
+
+    scheduler -- EventScheduler providing the timers (a new one is created by default)
+    map -- asyncore socket map to dispatch (default asyncore.socket_map)
+    poller -- SelectPoller, PollPoller, EpollPoller or compatible (default bestPoller())
+    max_events, max_time -- per-turn timer budget, see EventScheduler.poll
+    """
+    def __init__(self, scheduler=None, map=None, poller=None, max_events=None, max_time=None):
+        if scheduler is None:
+            scheduler = EventScheduler.EventScheduler()
+        if map is None:
+            map = asyncore.socket_map
+        if poller is None:
+            poller = bestPoller()
+        self.scheduler = scheduler
+        self.map = map
+        self.poller = poller
+        self.max_events = max_events
+        self.max_time = max_time
+        self.running = False
+
+    def iterate(self, timeout=None):
+        """Run one turn of the loop: wait for I/O until the next timer is due, then run due timers.
+           Returns the number of timers called.
+        """
+        timeout = self.scheduler.prepareWait(timeout)
+        try:
+            self.poller.poll(timeout, self.map, self.scheduler.waker)
+        finally:
+            self.scheduler.finishWait()
+        return self.scheduler.poll(self.max_events, self.max_time)
+
+    def run(self):
+        """Loop until stop() is called"""
+        self.running = True
+        while self.running:
+            self.iterate()
+
+    def stop(self):
+        """Make run() return after the current turn, can be called from any thread"""
+        self.running = False
+        self.scheduler.getWaker().wake()
+
+    def close(self):
+        self.poller.close()
+
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # Round trip cost with many idle connections and a subset of active ones.
+    # usage: reactor.py [idle] [active]
+    import sys
+    import timeit
+
+    idle = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    active = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rounds = 20
+
+    try:
+        import resource
+        needed = 2 * (idle + active) + 64
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    except (ImportError, ValueError):
+        pass
+
+    reads = [0]
+    class Sink(asyncore.dispatcher):
+        def handle_read(self):
+            self.recv(4096)
+            reads[0] += 1
+        def writable(self):
+            return False
+
+    map = {}
+    peers = []
+    for i in xrange(idle + active):
+        local, remote = socket.socketpair()
+        Sink(local, map)
+        peers.append(remote)
+    activePeers = peers[-active:]
+
+    def roundTrip(poller):
+        for peer in activePeers:
+            peer.send('x')
+        reads[0] = 0
+        while reads[0] < active:
+            poller.poll(1.0, map)
+
+    for cls in (SelectPoller, PollPoller, EpollPoller):
+        if cls is SelectPoller and max(map) >= 1024:
+            print "%-12s unusable with descriptors beyond FD_SETSIZE" % (cls.__name__)
+            continue
+        poller = cls()
+        poller.poll(0, map) # Registration is a one-time cost for the persistent pollers
+        cost = timeit.Timer(lambda: roundTrip(poller)).timeit(rounds) / rounds
+        print "%-12s %d idle + %d active: %.2f msec per round" % (cls.__name__, idle, active, cost * 1000)
+        poller.close()
@@ -0,0 +1,197 @@
+"""Hierarchical timing wheel implementation of the apy EventScheduler API.
+
+Meant for very large numbers of mostly-cancelled timers, such as per-connection idle timeouts.
+Scheduling, unscheduling and expiring an event are all O(1); the price is that fire times are
+rounded up to the next tick of the wheel, so events can fire up to one 'resolution' late.
+
+The wheel is the classic layout used by the Linux kernel: WHEEL_LEVELS wheels of WHEEL_SIZE
+slots each.  Level 0 holds the events due within the next WHEEL_SIZE ticks, and every higher
+level covers WHEEL_SIZE times the span of the one below it.  Whenever a lower wheel wraps
+around, the matching slot of the next wheel up is cascaded down into it.
+"""
+
+
+import math
+import time
+
+import EventScheduler
+
+
+WHEEL_BITS = 8
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 4
+# Events further out than this are parked in the top wheel and re-placed each time it cascades
+MAX_TICKS = (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+
+
+class TimingWheelScheduler(EventScheduler.EventScheduler):
+    """EventScheduler that keeps its events in a hierarchical timing wheel instead of a heap.
+
+    resolution -- length of one wheel tick in seconds
+    """
+    def __init__(self, time_func=time.time, resolution=0.01, monotonic=False, weights=None):
+        EventScheduler.EventScheduler.__init__(self, time_func, monotonic, weights)
+        self.resolution = float(resolution)
+        self.origin = self.time()
+        self.currentTick = 0 # Next tick to be expired
+        # Each slot maps its events to their scheduling sequence number, which keeps events with
+        # equal fire times in the order they were scheduled, the same as the heap does
+        self.wheels = [[{} for i in xrange(WHEEL_SIZE)] for level in xrange(WHEEL_LEVELS)]
+
+    def _place(self, event, sequence):
+        """File the event into the slot matching its fire time, loop thread only"""
+        tick = int(math.ceil((event.fireTime - self.origin) / self.resolution))
+        delta = tick - self.currentTick
+        if delta < 0:
+            # Already overdue, expire it on the next tick
+            tick = self.currentTick
+            delta = 0
+        elif delta > MAX_TICKS:
+            tick = self.currentTick + MAX_TICKS
+            delta = MAX_TICKS
+
+        level = 0
+        span = WHEEL_SIZE
+        while delta >= span:
+            level += 1
+            span <<= WHEEL_BITS
+        slot = self.wheels[level][(tick >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        slot[event] = sequence
+        event.entry = slot
+
+    def _cascade(self, level, index):
+        """Move the events of a higher level slot down to where they belong now"""
+        slot = self.wheels[level][index]
+        if slot:
+            events = slot.items()
+            slot.clear()
+            for event, sequence in events:
+                self._place(event, sequence)
+
+    def _push(self, event):
+        event.scheduler = self
+        event.cancelled = False
+        self.liveCount += 1
+        self._place(event, next(self._sequence))
+
+    def _pushMany(self, events):
+        # Already O(1) per event, there is nothing to gain from batching
+        for event in events:
+            self._push(event)
+
+    def _popDue(self, now):
+        # Round off float noise, so a poll at exactly next_deadline() expires that tick
+        targetTick = int((now - self.origin) / self.resolution + 1e-6)
+        if not self.liveCount:
+            # Nothing to expire, so there is no need to step through the empty ticks
+            self.currentTick = max(self.currentTick, targetTick + 1)
+            return []
+
+        workq = []
+        level0 = self.wheels[0]
+        while self.currentTick <= targetTick:
+            tick = self.currentTick
+            index = tick & WHEEL_MASK
+            level = 1
+            while index == 0 and level < WHEEL_LEVELS:
+                index = (tick >> (WHEEL_BITS * level)) & WHEEL_MASK
+                self._cascade(level, index)
+                level += 1
+
+            slot = level0[tick & WHEEL_MASK]
+            if slot:
+                for event in slot:
+                    event.entry = None
+                self.liveCount -= len(slot)
+                workq.extend(slot.iteritems())
+                slot.clear()
+            self.currentTick = tick + 1
+
+        # Events sharing a tick come out of the slot in arbitrary order
+        workq.sort(key=lambda item: (item[0].fireTime, item[1]))
+        return [event for event, sequence in workq]
+
+    def next_deadline(self):
+        """Return the end of the next non-empty tick, or of the next cascade if that comes first.
+           This can be earlier than the actual next event, but never later.
+        """
+        if self._completions or self._incoming:
+            return self.time()
+        for lane in self._lanes:
+            if lane:
+                return self.now
+        if not self.liveCount:
+            return None
+        level0 = self.wheels[0]
+        if not self.currentTick & WHEEL_MASK and self.liveCount > sum(map(len, level0)):
+            # The cascade of this tick is still to come and may fill any level 0 slot
+            return self.origin + self.currentTick * self.resolution
+        nextCascade = (self.currentTick | WHEEL_MASK) + 1
+        for tick in xrange(self.currentTick, nextCascade + 1):
+            if level0[tick & WHEEL_MASK]:
+                break
+        return self.origin + tick * self.resolution
+
+    def _remove(self, event):
+        slot = event.entry
+        if slot is not None:
+            del slot[event]
+            event.entry = None
+            self.liveCount -= 1
+            return True
+        return False
+
+    def printQueue(self):
+        """Debugging helper"""
+        events = []
+        for wheel in self.wheels:
+            for slot in wheel:
+                events.extend(slot)
+        events.sort(key=EventScheduler.EventElement.sortKey)
+        for mye in events:
+            try:
+                print mye.params[0], mye.fireTime, mye.delay
+            except IndexError:
+                print "no params", mye.fireTime, mye.delay
+
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # Compare the heap and the wheel with 10^3 .. 10^6 pending idle timeouts.  Each "turn" is what
+    # a busy connection does: cancel its idle timeout, arm a new one, and let the loop poll.
+    import random
+    import sys
+    import timeit
+
+    maxPending = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    turns = 10000
+
+    class FakeClock(object):
+        def __init__(self):
+            self.now = 1000.0
+        def __call__(self):
+            return self.now
+
+    def noop():
+        pass
+
+    pending = 1000
+    while pending <= maxPending:
+        for cls in (EventScheduler.EventScheduler, TimingWheelScheduler):
+            clock = FakeClock()
+            sked = cls(time_func=clock)
+            sked.poll() # Makes this the loop thread
+            timeouts = [sked.schedule(random.uniform(30.0, 300.0), noop) for i in xrange(pending)]
+
+            def turn():
+                i = random.randrange(pending)
+                sked.unschedule(timeouts[i])
+                timeouts[i] = sked.schedule(random.uniform(30.0, 300.0), noop)
+                clock.now += 0.001
+                sked.poll()
+
+            cost = timeit.Timer(turn).timeit(turns) / turns
+            print "%-22s %8d pending: %6.2f usec per cancel + schedule + poll" % (cls.__name__, pending, cost * 1e6)
+            del timeouts, sked
+        pending *= 10